@@ -1,4 +1,5 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, send_file, jsonify
+from flask import Flask, render_template, request, redirect, url_for, flash, send_file, jsonify, Response, g, \
+    has_request_context
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
 from flask_wtf import FlaskForm
@@ -7,21 +8,264 @@ from wtforms.validators import InputRequired, EqualTo, Length, ValidationError,
 from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime
 import uuid
+import importlib.util
 import os
 import json
-from threading import Thread
-import ollama
+import hashlib
+import hmac
+import sqlite3
+import time
+import gzip
+import html
+import re
+import base64
+import csv
+import multiprocessing
+import io
+import click
+from threading import Thread, Event, Lock, Condition
+from itertools import count
+from collections import Counter
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 from pathlib import Path
 from sqlalchemy import desc
+from sqlalchemy import event
+from sqlalchemy import inspect
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import IntegrityError, OperationalError, ProgrammingError
+from sqlalchemy.orm import Session, make_transient_to_detached, object_session
+from sqlalchemy.dialects import sqlite, postgresql, mysql
 from datetime import timedelta
 
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
 app = Flask(__name__)
 app.config.from_pyfile('config.py')
 db = SQLAlchemy(app)
 login_manager = LoginManager(app)
 login_manager.login_view = 'login'
 
-DEEPSEEK_MODEL = "deepseek-r1:7b"
+current_question_set_id = None
+
+
+@event.listens_for(Engine, 'connect')
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cursor = dbapi_connection.cursor()
+    for name, value in app.config['SQLITE_PRAGMAS'].items():
+        cursor.execute(f"PRAGMA {name}={value}")
+    cursor.close()
+
+
+def run_with_db_retry(work):
+    for attempt in range(app.config['DB_LOCK_RETRIES']):
+        try:
+            result = work()
+            db.session.commit()
+            return result
+        except OperationalError as e:
+            db.session.rollback()
+            if 'database is locked' not in str(e) or attempt == app.config['DB_LOCK_RETRIES'] - 1:
+                raise
+            time.sleep(0.1 * 2 ** attempt)
+
+
+class TTLCache:
+    def __init__(self, ttl, directory=None):
+        self.ttl = ttl
+        self.directory = directory
+        self.entries = {}
+        self.lock = Lock()
+        if directory:
+            os.makedirs(directory, mode=0o700, exist_ok=True)
+
+    def get(self, key):
+        if self.directory:
+            try:
+                with open(self.path(key), encoding='utf-8') as f:
+                    expires, value = json.load(f)
+            except (OSError, ValueError):
+                return None
+        else:
+            with self.lock:
+                expires, value = self.entries.get(key, (0, None))
+        return value if expires > time.time() else None
+
+    def set(self, key, value):
+        entry = (time.time() + self.ttl, value)
+        if self.directory:
+            path = self.path(key)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(entry, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        else:
+            with self.lock:
+                self.entries[key] = entry
+
+    def delete(self, key):
+        if self.directory:
+            try:
+                os.remove(self.path(key))
+            except FileNotFoundError:
+                pass
+        else:
+            with self.lock:
+                self.entries.pop(key, None)
+
+    def path(self, key):
+        return os.path.join(self.directory, hashlib.sha1(repr(key).encode('utf-8')).hexdigest())
+
+
+identity_cache = TTLCache(app.config['IDENTITY_CACHE_TTL'], app.config['IDENTITY_CACHE_DIR'])
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200)
+OLLAMA_BUCKETS = (0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+METRIC_HELP = {
+    'http_requests_total': ('counter', 'Количество HTTP-запросов'),
+    'http_request_duration_seconds': ('histogram', 'Время обработки HTTP-запроса'),
+    'db_queries_per_request': ('histogram', 'Количество SQL-запросов на HTTP-запрос'),
+    'db_query_duration_seconds': ('histogram', 'Суммарное время SQL-запросов на HTTP-запрос'),
+    'db_n_plus_one_total': ('counter', 'HTTP-запросы с повторяющимся SQL-запросом (N+1)'),
+    'ollama_request_duration_seconds': ('histogram', 'Время вызова Ollama'),
+    'ollama_prompt_tokens_total': ('counter', 'Токены промпта, обработанные Ollama'),
+    'ollama_eval_tokens_total': ('counter', 'Токены, сгенерированные Ollama'),
+    'ollama_errors_total': ('counter', 'Ошибки вызова Ollama'),
+    'analysis_errors_total': ('counter', 'Ошибки анализа команды'),
+    'analysis_cache_events_total': ('counter', 'События кэша анализов'),
+    'startup_duration_seconds': ('gauge', 'Длительность этапов запуска'),
+}
+
+
+class Metrics:
+    def __init__(self):
+        self.counters = {}
+        self.histograms = {}
+        self.lock = Lock()
+
+    def inc(self, name, labels=None, value=1):
+        key = (name, tuple(sorted((labels or {}).items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, labels, value, buckets=LATENCY_BUCKETS):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = {'buckets': buckets, 'counts': [0] * len(buckets), 'sum': 0,
+                                                    'count': 0}
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    histogram['counts'][i] += 1
+            histogram['sum'] += value
+            histogram['count'] += 1
+
+    def render(self, extra_counters=()):
+        with self.lock:
+            series = {}
+            for (name, labels), value in list(self.counters.items()) + list(extra_counters):
+                series.setdefault(name, []).append(f"{name}{format_labels(labels)} {value}")
+            for (name, labels), histogram in self.histograms.items():
+                lines = series.setdefault(name, [])
+                for bound, bucket_count in zip(histogram['buckets'], histogram['counts']):
+                    lines.append(f"{name}_bucket{format_labels(labels + (('le', str(bound)),))} {bucket_count}")
+                lines.append(f"{name}_bucket{format_labels(labels + (('le', '+Inf'),))} {histogram['count']}")
+                lines.append(f"{name}_sum{format_labels(labels)} {histogram['sum']}")
+                lines.append(f"{name}_count{format_labels(labels)} {histogram['count']}")
+        output = []
+        for name, lines in sorted(series.items()):
+            metric_type, description = METRIC_HELP.get(name, ('untyped', name))
+            output += [f"# HELP {name} {description}", f"# TYPE {name} {metric_type}"] + lines
+        return '\n'.join(output) + '\n'
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(key, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                          for key, value in labels) + '}'
+
+
+metrics = Metrics()
+
+
+def start_request_metrics():
+    g.request_started = time.perf_counter()
+    g.query_count = 0
+    g.query_seconds = 0
+    g.query_statements = Counter()
+
+
+def record_request_metrics(response):
+    if 'request_started' not in g:
+        return response
+    elapsed = time.perf_counter() - g.request_started
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    metrics.inc('http_requests_total', {'route': route, 'method': request.method, 'status': response.status_code})
+    metrics.observe('http_request_duration_seconds', {'route': route, 'method': request.method}, elapsed)
+    metrics.observe('db_queries_per_request', {'route': route}, g.query_count, QUERY_COUNT_BUCKETS)
+    metrics.observe('db_query_duration_seconds', {'route': route}, g.query_seconds)
+    repeated = [(statement, times) for statement, times in g.query_statements.items()
+                if times >= app.config['N_PLUS_ONE_THRESHOLD']]
+    if repeated:
+        metrics.inc('db_n_plus_one_total', {'route': route})
+        statement, times = max(repeated, key=lambda item: item[1])
+        app.logger.warning(f"Возможный N+1 в {request.method} {request.path}: запрос выполнен {times} раз: "
+                           f"{statement[:200]}")
+    if app.config['SLOW_REQUEST_MS'] and elapsed * 1000 >= app.config['SLOW_REQUEST_MS']:
+        app.logger.warning(f"Медленный запрос {request.method} {request.path}: {elapsed * 1000:.0f} мс, "
+                           f"SQL: {g.query_count} запросов за {g.query_seconds * 1000:.0f} мс")
+    return response
+
+
+def start_query_timer(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+
+def record_query_metrics(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['query_started'].pop()
+    if has_request_context() and 'query_statements' in g:
+        g.query_count += 1
+        g.query_seconds += elapsed
+        g.query_statements[statement] += 1
+
+
+def record_ollama_call(started, stream, model, response=None, error=None):
+    labels = {'model': model, 'stream': str(stream).lower()}
+    metrics.observe('ollama_request_duration_seconds', labels, time.perf_counter() - started, OLLAMA_BUCKETS)
+    if error is not None:
+        metrics.inc('ollama_errors_total', {'model': model, 'error': type(error).__name__})
+    if response is not None:
+        metrics.inc('ollama_prompt_tokens_total', {'model': model}, response.get('prompt_eval_count') or 0)
+        metrics.inc('ollama_eval_tokens_total', {'model': model}, response.get('eval_count') or 0)
+
+
+def init_instrumentation():
+    if not app.config['METRICS_ENABLED']:
+        return
+    app.before_request(start_request_metrics)
+    app.after_request(record_request_metrics)
+    event.listen(Engine, 'before_cursor_execute', start_query_timer)
+    event.listen(Engine, 'after_cursor_execute', record_query_metrics)
+
+
+init_instrumentation()
+
+DEEPSEEK_MODEL = app.config['ANALYSIS_MODEL']
+DEEPSEEK_OPTIONS = {'temperature': 0.3, 'num_ctx': 4096, 'top_p': 0.9}
+DISC_TYPES = ('d', 'i', 's', 'c')
 SYSTEM_PROMPT = """
 Ты — HR-аналитик с экспертизой в психологии команд. Анализируй данные по критериям:
 1. Распределение ролей по Белбину
@@ -29,16 +273,20 @@ SYSTEM_PROMPT = """
 3. Потенциальные конфликты
 4. Рекомендации по оптимизации
 
+Поле "aggregates" содержит уже рассчитанные показатели команды: количество сотрудников каждого типа DISC,
+включая смешанные (disc_counts), средний балл EQ по шкале ответов 1–5 и баллы по шкалам (eq), наиболее похожие
+по DISC пары сотрудников (synergy_candidates). Поле "employees" содержит тип DISC (две буквы — смешанный тип) и балл EQ каждого сотрудника.
+Не пересчитывай эти числа, используй их для описаний и рекомендаций.
+
 Формат ответа (JSON):
 {
   "disc_analysis": {
-    "d": {"count": int, "description": str},
-    "i": {"count": int, "description": str},
-    "s": {"count": int, "description": str},
-    "c": {"count": int, "description": str}
+    "d": {"description": str},
+    "i": {"description": str},
+    "s": {"description": str},
+    "c": {"description": str}
   },
   "eq_analysis": {
-    "average_score": float,
     "strong_areas": [str],
     "weak_areas": [str]
   },
@@ -53,6 +301,11 @@ SYSTEM_PROMPT = """
   }
 }
 """
+REDUCE_PROMPT = SYSTEM_PROMPT + """
+Тебе переданы частичные анализы отдельных групп одной команды (поле "partials", у каждой группы указан team_size).
+Объедини их в единый анализ всей команды в том же формате: сведи описания типов DISC, объедини и убери повторы
+в списках, сформулируй общие рекомендации для команды.
+"""
 
 
 class User(db.Model, UserMixin):
@@ -66,6 +319,10 @@ class User(db.Model, UserMixin):
     test_link = db.Column(db.String(500), nullable=True)
     test_expires = db.Column(db.DateTime, nullable=True)
 
+    __table_args__ = (
+        db.Index('ix_users_comp_name_role_name', 'comp_name', 'role', 'name'),
+    )
+
 
 class Test(db.Model):
     __tablename__ = 'tests'
@@ -74,6 +331,20 @@ class Test(db.Model):
     created_at = db.Column(db.DateTime, server_default=db.func.now())
     end_date = db.Column(db.DateTime, nullable=False)
     is_active = db.Column(db.Boolean, default=True)
+    question_set_id = db.Column(db.Integer, db.ForeignKey('question_sets.id'), nullable=True)
+
+    __table_args__ = (
+        db.Index('ix_tests_company_active_end', 'company_id', 'is_active', 'end_date'),
+        db.Index('ix_tests_active_end', 'is_active', 'end_date'),
+    )
+
+
+class QuestionSet(db.Model):
+    __tablename__ = 'question_sets'
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False)
+    checksum = db.Column(db.String(64), unique=True, nullable=False)
+    created_at = db.Column(db.DateTime, server_default=db.func.now())
 
 
 class Question(db.Model):
@@ -82,6 +353,7 @@ class Question(db.Model):
     text = db.Column(db.String(500), nullable=False)
     question_type = db.Column(db.String(20), nullable=False)
     category = db.Column(db.String(50))
+    question_set_id = db.Column(db.Integer, db.ForeignKey('question_sets.id'), nullable=True)
 
 
 class Answer(db.Model):
@@ -93,14 +365,46 @@ class Answer(db.Model):
     value = db.Column(db.Integer, nullable=False)
     created_at = db.Column(db.DateTime, server_default=db.func.now())
 
+    __table_args__ = (
+        db.Index('ix_answers_user_test', 'user_id', 'test_id'),
+        db.Index('ix_answers_test_user', 'test_id', 'user_id'),
+    )
+
 
 class TestQuestion(db.Model):
     __tablename__ = 'test_questions'
     id = db.Column(db.Integer, primary_key=True)
-    test_id = db.Column(db.Integer, db.ForeignKey('tests.id'), nullable=False)
+    test_id = db.Column(db.Integer, db.ForeignKey('tests.id'), nullable=False, index=True)
     question_id = db.Column(db.Integer, db.ForeignKey('questions.id'), nullable=False)
 
 
+class EmployeeScore(db.Model):
+    __tablename__ = 'employee_scores'
+    __table_args__ = (
+        db.UniqueConstraint('test_id', 'user_id', 'question_type', 'category'),
+        db.Index('ix_employee_scores_user_test', 'user_id', 'test_id'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    test_id = db.Column(db.Integer, db.ForeignKey('tests.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    question_type = db.Column(db.String(20), nullable=False)
+    category = db.Column(db.String(50), nullable=False, default='')
+    total = db.Column(db.Integer, nullable=False, default=0)
+    answer_count = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, server_default=db.func.now(), onupdate=db.func.now())
+
+
+class AnswerSubmission(db.Model):
+    __tablename__ = 'answer_submissions'
+    __table_args__ = (db.UniqueConstraint('user_id', 'test_id'),)
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    test_id = db.Column(db.Integer, db.ForeignKey('tests.id'), nullable=False)
+    idempotency_key = db.Column(db.String(100), nullable=True)
+    answer_count = db.Column(db.Integer, nullable=False)
+    created_at = db.Column(db.DateTime, server_default=db.func.now())
+
+
 class AnalysisResult(db.Model):
     __tablename__ = 'analysis_results'
     id = db.Column(db.Integer, primary_key=True)
@@ -113,6 +417,35 @@ class AnalysisResult(db.Model):
     result_data = db.Column(db.Text)
     report_filename = db.Column(db.String(100))
     error = db.Column(db.Text)
+    payload = db.Column(db.Text)
+    attempts = db.Column(db.Integer, default=0, nullable=False)
+    started_at = db.Column(db.DateTime, nullable=True)
+    heartbeat_at = db.Column(db.DateTime, nullable=True)
+    next_attempt_at = db.Column(db.DateTime, nullable=True)
+    draft_for_id = db.Column(db.Integer, db.ForeignKey('analysis_results.id'), nullable=True)
+    scheduled = db.Column(db.Boolean, default=False, nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_analysis_results_user_status_completed', 'user_id', 'status', 'completed_at'),
+        db.Index('ix_analysis_results_status_next_attempt', 'status', 'next_attempt_at'),
+    )
+
+
+class AnalysisCache(db.Model):
+    __tablename__ = 'analysis_cache'
+    key = db.Column(db.String(64), primary_key=True)
+    model = db.Column(db.String(50), nullable=False)
+    result_data = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime, server_default=db.func.now())
+    last_used_at = db.Column(db.DateTime, server_default=db.func.now(), index=True)
+    hits = db.Column(db.Integer, default=0, nullable=False)
+
+
+class SchemaMigration(db.Model):
+    __tablename__ = 'schema_migrations'
+    version = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100), nullable=False)
+    applied_at = db.Column(db.DateTime, server_default=db.func.now())
 
 
 class RegisterForm(FlaskForm):
@@ -144,28 +477,413 @@ class TestCreationForm(FlaskForm):
 
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    row = identity_cache.get(('user', int(user_id)))
+    if row is None:
+        user = db.session.get(User, int(user_id))
+        if user:
+            identity_cache.set(('user', user.id), cached_user_row(user))
+        return user
+    user = User(**{name: datetime.fromisoformat(value) if value and name in USER_DATETIME_COLUMNS else value
+                   for name, value in row.items()})
+    make_transient_to_detached(user)
+    return user
+
+
+USER_DATETIME_COLUMNS = {column.name for column in User.__table__.columns if isinstance(column.type, db.DateTime)}
+
+
+def cached_user_row(user):
+    row = {}
+    for column in User.__table__.columns:
+        if column.name != 'password':
+            value = getattr(user, column.name)
+            row[column.name] = value.isoformat() if isinstance(value, datetime) else value
+    return row
+
+
+def company_roster(comp_name):
+    roster = identity_cache.get(('roster', comp_name))
+    if roster is None:
+        roster = [{'id': employee.id, 'name': employee.name, 'email': employee.email}
+                  for employee in company_employees_query(comp_name).with_entities(
+                      User.id, User.name, User.email).order_by(User.id)]
+        identity_cache.set(('roster', comp_name), roster)
+    return roster
+
+
+@event.listens_for(User, 'after_insert')
+@event.listens_for(User, 'after_update')
+@event.listens_for(User, 'after_delete')
+def collect_identity_cache_keys(mapper, connection, user):
+    keys = object_session(user).info.setdefault('identity_cache_keys', set())
+    keys.add(('user', user.id))
+    history = db.inspect(user).attrs.comp_name.history
+    keys.update(('roster', comp_name) for comp_name in {user.comp_name, *history.deleted})
+
+
+@event.listens_for(Session, 'after_commit')
+def invalidate_identity_cache(session):
+    for key in session.info.pop('identity_cache_keys', ()):
+        identity_cache.delete(key)
+
+
+@event.listens_for(Session, 'after_rollback')
+def discard_identity_cache_keys(session):
+    session.info.pop('identity_cache_keys', None)
 
 
-def analyze_with_deepseek(test_data):
+def analyze_with_deepseek(test_data, on_progress=None, model=DEEPSEEK_MODEL):
     try:
-        response = ollama.generate(
-            model=DEEPSEEK_MODEL,
-            system=SYSTEM_PROMPT,
-            prompt=json.dumps(test_data),
-            format="json",
-            options={'temperature': 0.3, 'num_ctx': 4096, 'top_p': 0.9}
-        )
-        return json.loads(response['response'])
+        aggregates = compute_team_aggregates(test_data)
+        payload = analysis_prompt_payload(test_data, aggregates)
+        if estimate_tokens(payload) <= app.config['ANALYSIS_CHUNK_TOKENS']:
+            result = generate_json(SYSTEM_PROMPT, payload, on_progress, model)
+        else:
+            result = map_reduce_analysis(payload, on_progress, model)
+        return apply_team_aggregates(result, aggregates)
     except Exception as e:
-        print(f"Ошибка анализа: {str(e)}")
+        metrics.inc('analysis_errors_total', {'error': type(e).__name__})
+        app.logger.exception(f"Ошибка анализа: {str(e)}")
         return {"error": str(e)}
 
 
-def generate_team_report(analysis_data):
+def analysis_prompt_payload(test_data, aggregates):
+    return {'team_size': test_data['team_size'], 'industry': test_data['industry'], 'aggregates': aggregates,
+            'employees': team_employees(test_data)}
+
+
+def generate_json(system, payload, on_progress=None, model=DEEPSEEK_MODEL):
+    ollama_breaker.check()
+    started = time.perf_counter()
+    try:
+        if on_progress is None:
+            response = ollama_client.generate(
+                model=model,
+                system=system,
+                prompt=json.dumps(payload),
+                format="json",
+                options=DEEPSEEK_OPTIONS,
+                keep_alive=app.config['OLLAMA_KEEP_ALIVE']
+            )
+            record_ollama_call(started, False, model, response)
+            ollama_breaker.record_success()
+            return json.loads(response['response'])
+        chunks = []
+        chunk = None
+        for chunk in ollama_client.generate(
+            model=model,
+            system=system,
+            prompt=json.dumps(payload),
+            format="json",
+            options=DEEPSEEK_OPTIONS,
+            keep_alive=app.config['OLLAMA_KEEP_ALIVE'],
+            stream=True
+        ):
+            chunks.append(chunk['response'])
+            on_progress(chunk.get('eval_count') or len(chunks), chunk['response'])
+        record_ollama_call(started, True, model, chunk)
+        ollama_breaker.record_success()
+        return json.loads(''.join(chunks))
+    except ValueError:
+        raise
+    except Exception as e:
+        record_ollama_call(started, on_progress is not None, model, error=e)
+        ollama_breaker.record_failure()
+        raise
+
+
+class OllamaUnavailable(Exception):
+    pass
+
+
+class CircuitBreaker:
+    def __init__(self, threshold, reset_timeout):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.lock = Lock()
+
+    def check(self):
+        with self.lock:
+            if self.opened_at is None:
+                return
+            remaining = self.opened_at + self.reset_timeout - time.time()
+            if remaining > 0:
+                raise OllamaUnavailable(f"Ollama недоступна, повторная попытка через {remaining:.0f} с")
+            self.opened_at = time.time()
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.failures >= self.threshold:
+                self.opened_at = time.time()
+
+    @property
+    def is_open(self):
+        with self.lock:
+            return self.opened_at is not None and time.time() - self.opened_at < self.reset_timeout
+
+    @property
+    def state(self):
+        if self.is_open:
+            return 'open'
+        return 'half_open' if self.opened_at is not None else 'closed'
+
+
+class LazyOllamaClient:
+    def __init__(self, host, timeout):
+        self.host = host
+        self.timeout = timeout
+        self.client = None
+        self.lock = Lock()
+
+    def __getattr__(self, name):
+        return getattr(self.get_client(), name)
+
+    def get_client(self):
+        if self.client is None:
+            with self.lock:
+                if self.client is None:
+                    import ollama
+                    self.client = ollama.Client(host=self.host, timeout=self.timeout)
+        return self.client
+
+
+ollama_client = LazyOllamaClient(app.config['OLLAMA_HOST'], app.config['OLLAMA_TIMEOUT'])
+ollama_breaker = CircuitBreaker(app.config['OLLAMA_BREAKER_THRESHOLD'], app.config['OLLAMA_BREAKER_RESET'])
+
+
+def warm_up_models():
+    for model in analysis_models():
+        try:
+            ollama_client.generate(model=model, prompt='', keep_alive=app.config['OLLAMA_KEEP_ALIVE'])
+            ollama_breaker.record_success()
+        except Exception as e:
+            app.logger.warning(f"Не удалось прогреть модель {model}: {str(e)}")
+
+
+def ollama_health():
+    models = analysis_models()
+    try:
+        available = {model.model for model in ollama_client.list().models}
+        loaded = {model.model for model in ollama_client.ps().models}
+    except Exception as e:
+        return {'status': 'unavailable', 'models': models, 'circuit': ollama_breaker.state, 'error': str(e)}
+    return {'status': 'ok' if set(models) <= available else 'model_missing', 'circuit': ollama_breaker.state,
+            'models': {model: {'available': model in available, 'loaded': model in loaded} for model in models}}
+
+
+@app.route('/api/ollama/health')
+def ollama_health_check():
+    health = ollama_health()
+    return jsonify(health), 200 if health['status'] == 'ok' and not ollama_breaker.is_open else 503
+
+
+def analysis_models():
+    models = [DEEPSEEK_MODEL, app.config['ANALYSIS_DRAFT_MODEL']] + [
+        route['model'] for route in app.config['ANALYSIS_MODEL_ROUTES']]
+    return list(dict.fromkeys(model for model in models if model))
+
+
+def route_analysis_model(test_data):
+    tokens = estimate_tokens(analysis_prompt_payload(test_data, compute_team_aggregates(test_data)))
+    for route in app.config['ANALYSIS_MODEL_ROUTES']:
+        if (test_data['team_size'] <= route.get('max_team_size', float('inf')) and
+                tokens <= route.get('max_tokens', float('inf'))):
+            return route['model']
+    return DEEPSEEK_MODEL
+
+
+def draft_analysis_model(model):
+    draft_model = app.config['ANALYSIS_DRAFT_MODEL']
+    return draft_model if draft_model and draft_model != model else None
+
+
+def estimate_tokens(payload):
+    return len(json.dumps(payload)) // app.config['ANALYSIS_CHARS_PER_TOKEN'] + 1
+
+
+def pack_chunks(items, budget):
+    chunks, current, used = [], [], 0
+    for item in items:
+        size = estimate_tokens(item)
+        if current and used + size > budget:
+            chunks.append(current)
+            current, used = [], 0
+        current.append(item)
+        used += size
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def split_team_data(payload):
+    budget = app.config['ANALYSIS_CHUNK_TOKENS'] - estimate_tokens(dict(payload, employees=[]))
+    return [dict(payload, employees=chunk, team_size=len(chunk)) for chunk in pack_chunks(payload['employees'], budget)]
+
+
+def map_reduce_analysis(test_data, on_progress=None, model=DEEPSEEK_MODEL):
+    chunks = split_team_data(test_data)
+    with ThreadPoolExecutor(max_workers=app.config['ANALYSIS_MAP_CONCURRENCY']) as executor:
+        analyses = list(executor.map(lambda chunk: generate_json(SYSTEM_PROMPT, chunk, model=model), chunks))
+        individual = []
+        partials = []
+        for chunk, analysis in zip(chunks, analyses):
+            individual += analysis.get('recommendations', {}).pop('individual', [])
+            partials.append({'team_size': chunk['team_size'], 'analysis': analysis})
+        while len(partials) > 1 and estimate_tokens(partials) > app.config['ANALYSIS_CHUNK_TOKENS']:
+            groups = pack_chunks(partials, app.config['ANALYSIS_CHUNK_TOKENS'])
+            if len(groups) == len(partials):
+                groups = [partials[i:i + 2] for i in range(0, len(partials), 2)]
+            partials = list(executor.map(lambda group: reduce_partials(group, model), groups))
+    result = generate_json(REDUCE_PROMPT, {'team_size': test_data['team_size'], 'industry': test_data['industry'],
+                                           'partials': partials}, on_progress, model)
+    result.setdefault('recommendations', {})['individual'] = individual
+    return result
+
+
+def reduce_partials(partials, model=DEEPSEEK_MODEL):
+    team_size = sum(partial['team_size'] for partial in partials)
+    analysis = generate_json(REDUCE_PROMPT, {'team_size': team_size, 'partials': partials}, model=model)
+    analysis.get('recommendations', {}).pop('individual', None)
+    return {'team_size': team_size, 'analysis': analysis}
+
+
+def compute_team_aggregates(test_data):
+    import numpy as np
+    disc_names = [entry['name'] for entry in test_data['disc_results']]
+    disc = np.array([[entry[disc_type] for disc_type in DISC_TYPES] for entry in test_data['disc_results']],
+                    dtype=float).reshape(-1, len(DISC_TYPES))
+    disc_counts = {**dict.fromkeys(DISC_TYPES, 0), **Counter(disc_type_labels(disc))}
+    eq_results = test_data['eq_results']
+    eq_scores = np.array([entry['score'] for entry in eq_results], dtype=float)
+    categories = sorted({category for entry in eq_results for category in entry.get('categories', {})})
+    eq_matrix = np.array([[entry.get('categories', {}).get(category, np.nan) for category in categories]
+                          for entry in eq_results], dtype=float).reshape(len(eq_results), len(categories))
+    eq_categories = {}
+    if eq_matrix.size:
+        means = np.nanmean(eq_matrix, axis=0)
+        p25, median, p75 = np.nanpercentile(eq_matrix, [25, 50, 75], axis=0)
+        eq_categories = {category: {'mean': round(float(means[i]), 1), 'p25': round(float(p25[i]), 1),
+                                    'median': round(float(median[i]), 1), 'p75': round(float(p75[i]), 1)}
+                         for i, category in enumerate(categories)}
+    return {
+        'disc_counts': disc_counts,
+        'eq': {'average_score': round(float(eq_scores.mean()), 1) if eq_scores.size else 0,
+               'categories': eq_categories},
+        'synergy_candidates': synergy_candidates(disc_names, disc, app.config['ANALYSIS_SYNERGY_CANDIDATES'])
+    }
+
+
+def synergy_candidates(names, disc, limit):
+    import numpy as np
+    if len(names) < 2:
+        return []
+    vectors = disc / np.maximum(np.linalg.norm(disc, axis=1, keepdims=True), 1e-9)
+    limit = min(limit, len(names) * (len(names) - 1) // 2)
+    columns = np.arange(len(names))
+    best_values, best_rows, best_cols = np.empty(0), np.empty(0, dtype=int), np.empty(0, dtype=int)
+    block_rows = app.config['ANALYSIS_SYNERGY_BLOCK_ROWS']
+    for start in range(0, len(names) - 1, block_rows):
+        rows = np.arange(start, min(start + block_rows, len(names)))
+        similarity = vectors[rows] @ vectors.T
+        similarity[columns[None, :] <= rows[:, None]] = -np.inf
+        top = np.argpartition(similarity, -min(limit, similarity.size), axis=None)[-limit:]
+        block_rows_index, block_cols = np.unravel_index(top, similarity.shape)
+        best_values = np.concatenate([best_values, similarity.flat[top]])
+        best_rows = np.concatenate([best_rows, rows[block_rows_index]])
+        best_cols = np.concatenate([best_cols, block_cols])
+        if best_values.size > limit:
+            keep = np.argpartition(best_values, -limit)[-limit:]
+            best_values, best_rows, best_cols = best_values[keep], best_rows[keep], best_cols[keep]
+    order = np.argsort(-best_values)
+    return [{'pair': f"{names[a]} — {names[b]}", 'similarity': round(float(value), 2)}
+            for value, a, b in zip(best_values[order].tolist(), best_rows[order].tolist(), best_cols[order].tolist())
+            if value != -np.inf]
+
+
+def disc_type_labels(disc):
+    import numpy as np
+    order = np.argsort(-disc, axis=1)[:, :2]
+    top = np.take_along_axis(disc, order, axis=1)
+    mixed = top[:, 0] - top[:, 1] <= 5
+    return [DISC_TYPES[first] + (DISC_TYPES[second] if is_mixed else '')
+            for (first, second), is_mixed in zip(order.tolist(), mixed.tolist())]
+
+
+def team_employees(test_data):
+    import numpy as np
+    employees = {}
+    disc = np.array([[entry[disc_type] for disc_type in DISC_TYPES] for entry in test_data['disc_results']],
+                    dtype=float).reshape(-1, len(DISC_TYPES))
+    for entry, label in zip(test_data['disc_results'], disc_type_labels(disc)):
+        employees.setdefault(entry['name'], {'name': entry['name']})['disc_type'] = label
+    for entry in test_data['eq_results']:
+        employees.setdefault(entry['name'], {'name': entry['name']})['eq_score'] = entry['score']
+    return list(employees.values())
+
+
+def apply_team_aggregates(result, aggregates):
+    disc_analysis = result.setdefault('disc_analysis', {})
+    for disc_type, disc_count in aggregates['disc_counts'].items():
+        disc_analysis.setdefault(disc_type, {})['count'] = disc_count
+    eq_analysis = result.setdefault('eq_analysis', {})
+    eq_analysis['average_score'] = aggregates['eq']['average_score']
+    eq_analysis['categories'] = aggregates['eq']['categories']
+    return result
+
+
+analysis_cache_stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+
+def analysis_cache_key(test_data, model=DEEPSEEK_MODEL):
+    canonical = json.dumps({'model': model, 'system': SYSTEM_PROMPT, 'options': DEEPSEEK_OPTIONS,
+                            'test_data': test_data}, sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+def get_cached_analysis(test_data, model=DEEPSEEK_MODEL):
+    now = datetime.utcnow()
+    entry = db.session.get(AnalysisCache, analysis_cache_key(test_data, model))
+    if not entry or entry.created_at < now - timedelta(seconds=app.config['ANALYSIS_CACHE_TTL']):
+        analysis_cache_stats['misses'] += 1
+        return None
+    entry.hits += 1
+    entry.last_used_at = now
+    analysis_cache_stats['hits'] += 1
+    return json.loads(entry.result_data)
+
+
+def store_cached_analysis(test_data, result, model=DEEPSEEK_MODEL):
+    key = analysis_cache_key(test_data, model)
+    entry = db.session.get(AnalysisCache, key) or AnalysisCache(key=key, model=model)
+    entry.result_data = json.dumps(result, ensure_ascii=False)
+    entry.created_at = entry.last_used_at = datetime.utcnow()
+    db.session.add(entry)
+    db.session.flush()
+    evict_analysis_cache()
+
+
+def evict_analysis_cache():
+    expired_before = datetime.utcnow() - timedelta(seconds=app.config['ANALYSIS_CACHE_TTL'])
+    evicted = AnalysisCache.query.filter(AnalysisCache.created_at < expired_before).delete(synchronize_session=False)
+    keep = db.select(AnalysisCache.key).order_by(desc(AnalysisCache.last_used_at)).limit(
+        app.config['ANALYSIS_CACHE_MAX_ENTRIES']).subquery()
+    keep = db.select(keep.c.key)
+    evicted += AnalysisCache.query.filter(AnalysisCache.key.not_in(keep)).delete(synchronize_session=False)
+    analysis_cache_stats['evictions'] += evicted
+
+
+def generate_team_report(analysis_data, generated_at=None, model=DEEPSEEK_MODEL):
     return f"""# Отчет по анализу команды
-**Дата:** {datetime.now().strftime('%d.%m.%Y %H:%M')}
-**Модель:** {DEEPSEEK_MODEL}
+**Дата:** {(generated_at or datetime.now()).strftime('%d.%m.%Y %H:%M')}
+**Модель:** {model}
 
 ## 1. Распределение психотипов (DISC)
 {format_disc_section(analysis_data.get('disc_analysis', {}))}
@@ -190,7 +908,7 @@ def format_disc_section(disc_data):
 
 
 def format_eq_section(eq_data):
-    return (f"### Средний балл: {eq_data.get('average_score', 0):.1f}/100\n\n" +
+    return (f"### Средний балл: {eq_data.get('average_score', 0):.1f}/{ANSWER_SCALES['eq'][1]}\n\n" +
             "#### Сильные стороны:\n" + "\n".join(f"- {area}" for area in eq_data.get('strong_areas', [])) +
             "\n\n#### Слабые стороны:\n" + "\n".join(f"- {area}" for area in eq_data.get('weak_areas', [])))
 
@@ -209,49 +927,164 @@ def format_recommendations_section(recommendations):
     return ("### Индивидуальные рекомендации:\n" + individual + "\n\n### Рекомендации для команды:\n" + team)
 
 
-def save_report(content, filename):
-    report_path = os.path.join('reports', filename)
-    with open(report_path, 'w', encoding='utf-8') as f:
+REPORT_RENDERER_VERSION = 2
+REPORT_FORMATS = {
+    'md': 'text/markdown',
+    'html': 'text/html',
+    'pdf': 'application/pdf',
+    'json': 'application/json',
+}
+
+
+def render_report(analysis, report_format):
+    result = json.loads(analysis.result_data)
+    if report_format == 'json':
+        return json.dumps(result, ensure_ascii=False, indent=2).encode('utf-8')
+    markdown = generate_team_report(result, analysis.completed_at, analysis.model)
+    if report_format == 'md':
+        return markdown.encode('utf-8')
+    report_html = render_template('report.html', analysis=analysis, body=markdown_to_html(markdown))
+    if report_format == 'html':
+        return report_html.encode('utf-8')
+    from weasyprint import HTML
+    return HTML(string=report_html).write_pdf()
+
+
+def markdown_to_html(markdown):
+    lines = []
+    in_list = False
+    for line in markdown.splitlines():
+        if line.startswith('- '):
+            if not in_list:
+                lines.append('<ul>')
+                in_list = True
+            lines.append(f"<li>{markdown_inline_to_html(line[2:])}</li>")
+            continue
+        if in_list:
+            lines.append('</ul>')
+            in_list = False
+        level = len(line) - len(line.lstrip('#'))
+        if level and line[level:level + 1] == ' ':
+            lines.append(f"<h{level}>{markdown_inline_to_html(line[level + 1:])}</h{level}>")
+        elif line.strip():
+            lines.append(f"<p>{markdown_inline_to_html(line)}</p>")
+    if in_list:
+        lines.append('</ul>')
+    return '\n'.join(lines)
+
+
+def markdown_inline_to_html(text):
+    return re.sub(r'\*\*(.+?)\*\*', r'<strong>\1</strong>', html.escape(text))
+
+
+def cached_report(analysis, report_format):
+    source = f"{REPORT_RENDERER_VERSION}:{report_format}:{analysis.model}:{analysis.completed_at.isoformat()}:" \
+             f"{analysis.result_data}"
+    digest = hashlib.sha256(source.encode('utf-8')).hexdigest()
+    cache_dir = app.config['REPORT_CACHE_DIR']
+    path = os.path.join(cache_dir, f"{digest}.{report_format}")
+    if os.path.exists(path):
+        os.utime(path)
+        for variant_path, compress in report_variants(path):
+            try:
+                os.utime(variant_path)
+            except FileNotFoundError:
+                with open(path, 'rb') as f:
+                    write_report_file(variant_path, compress(f.read()))
+        return digest, path
+    content = render_report(analysis, report_format)
+    os.makedirs(cache_dir, exist_ok=True)
+    write_report_file(path, content)
+    for variant_path, compress in report_variants(path):
+        write_report_file(variant_path, compress(content))
+    evict_report_cache()
+    return digest, path
+
+
+def report_variants(path):
+    variants = [(f"{path}.gz", gzip.compress)]
+    if brotli:
+        variants.append((f"{path}.br", brotli.compress))
+    return variants
+
+
+def pdf_available():
+    return importlib.util.find_spec('weasyprint') is not None
+
+
+def write_report_file(path, content):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
         f.write(content)
-    return filename
+    os.replace(tmp_path, path)
+
+
+def evict_report_cache():
+    entries = sorted((entry.stat().st_mtime, entry.stat().st_size, entry.path)
+                     for entry in os.scandir(app.config['REPORT_CACHE_DIR']) if entry.is_file())
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in entries:
+        if total <= app.config['REPORT_CACHE_MAX_BYTES']:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
 
 
 def prepare_test_data(test_id):
-    from sqlalchemy.orm import joinedload
-    test = db.session.query(Test).filter_by(id=test_id).first()
+    test = db.session.get(Test, test_id)
     if not test:
         raise ValueError("Тест не найден")
     if test.company_id != current_user.id:
         raise PermissionError("Нет доступа к этому тесту")
-    employees = db.session.query(User).filter_by(comp_name=current_user.name, role='employee').all()
-    test_questions = db.session.query(TestQuestion).filter_by(test_id=test_id).options(
-        joinedload(TestQuestion.question)).all()
+    return build_test_data(test, current_user.name)
+
+
+def build_test_data(test, comp_name):
+    employees = company_roster(comp_name)
+    score_rows = employee_score_rows_query(test.id, comp_name).all()
+    grouped = {}
+    for row in score_rows:
+        disc_answers, eq_answers = grouped.setdefault(row.user_id, ([], []))
+        if row.question_type == 'disc':
+            disc_answers.append({'question_type': row.category, 'value': row.total})
+        elif row.question_type == 'eq':
+            eq_answers.append({'category': row.category, 'value': row.total, 'count': row.answer_count})
     test_data = {'disc_results': [], 'eq_results': [], 'team_size': len(employees), 'industry': "IT"}
     for employee in employees:
-        answers = db.session.query(Answer).filter_by(user_id=employee.id, test_id=test_id).all()
-        if not answers:
+        if employee['id'] not in grouped:
             continue
-        disc_answers = []
-        eq_answers = []
-        for answer in answers:
-            question = next((tq.question for tq in test_questions if tq.question_id == answer.question_id), None)
-            if not question:
-                continue
-            if question.question_type == 'disc':
-                disc_answers.append({'question_type': question.category, 'value': answer.value})
-            elif question.question_type == 'eq':
-                eq_answers.append({'category': question.category, 'value': answer.value})
+        disc_answers, eq_answers = grouped[employee['id']]
         if disc_answers:
             disc_scores = calculate_disc_scores(disc_answers)
             test_data['disc_results'].append(
-                {'name': employee.name, 'd': disc_scores.get('d', 0), 'i': disc_scores.get('i', 0),
+                {'name': employee['name'], 'd': disc_scores.get('d', 0), 'i': disc_scores.get('i', 0),
                  's': disc_scores.get('s', 0), 'c': disc_scores.get('c', 0)})
         if eq_answers:
             eq_score = calculate_eq_score(eq_answers)
-            test_data['eq_results'].append({'name': employee.name, 'score': eq_score})
+            test_data['eq_results'].append({'name': employee['name'], 'score': eq_score, 'categories': {
+                answer['category']: round(answer['value'] / answer['count'], 1) for answer in eq_answers}})
     return test_data
 
 
+def employee_score_rows_query(test_id, comp_name):
+    return db.session.query(
+        EmployeeScore.user_id,
+        EmployeeScore.question_type,
+        EmployeeScore.category,
+        EmployeeScore.total,
+        EmployeeScore.answer_count
+    ).join(
+        User, User.id == EmployeeScore.user_id
+    ).filter(
+        EmployeeScore.test_id == test_id,
+        User.comp_name == comp_name,
+        User.role == 'employee'
+    )
+
+
 def calculate_disc_scores(answers):
     scores = {'d': 0, 'i': 0, 's': 0, 'c': 0}
     type_mapping = {'d': 'd', 'i': 'i', 's': 's', 'c': 'c', 'dominance': 'd', 'influence': 'i', 'steadiness': 's',
@@ -268,95 +1101,203 @@ def calculate_disc_scores(answers):
 def calculate_eq_score(answers):
     if not answers:
         return 0
-    return round(sum(answer['value'] for answer in answers) / len(answers), 1)
-
-
-def create_disc_questions(test_id):
-    questions = [
-        ("Я легко адаптируюсь к новым ситуациям.", "i"),
-        ("Я люблю быть в центре внимания.", "i"),
-        ("Я предпочитаю работать в одиночку.", "s"),
-        ("Я часто беру на себя ответственность в группе.", "d"),
-        ("Я стараюсь избегать конфликтов.", "s"),
-        ("Я быстро принимаю решения.", "d"),
-        ("Я ценю стабильность и предсказуемость.", "s"),
-        ("Я люблю соревноваться и побеждать.", "d"),
-        ("Я часто помогаю другим, даже если это не в моих интересах.", "s"),
-        ("Я легко нахожу общий язык с новыми людьми.", "i"),
-        ("Я предпочитаю тщательно анализировать информацию перед принятием решения.", "c"),
-        ("Я люблю рисковать.", "d"),
-        ("Я стараюсь избегать резких изменений.", "s"),
-        ("Я часто выступаю инициатором новых идей.", "i"),
-        ("Я предпочитаю работать в команде, а не в одиночку.", "i"),
-        ("Я часто ставлю перед собой амбициозные цели.", "d"),
-        ("Я стараюсь избегать конфронтации.", "s"),
-        ("Я люблю, когда всё идет по плану.", "c"),
-        ("Я часто беру на себя роль лидера.", "d"),
-        ("Я ценю гармонию в отношениях.", "s"),
-        ("Я быстро устаю от рутины.", "i"),
-        ("Я предпочитаю действовать, а не долго обсуждать.", "d"),
-        ("Я стараюсь быть дипломатичным в общении.", "s"),
-        ("Я люблю решать сложные задачи.", "c"),
-        ("Я часто сомневаюсь в своих решениях.", "s"),
-        ("Я люблю, когда меня хвалят за мои достижения.", "i"),
-        ("Я предпочитаю следовать правилам.", "c"),
-        ("Я часто ищу новые возможности для роста.", "d"),
-        ("Я стараюсь избегать споров.", "s"),
-        ("Я люблю, когда всё организовано и структурировано.", "c")
-    ]
-    for text, q_type in questions:
-        question = Question(text=text, question_type="disc", category=q_type)
-        db.session.add(question)
-        db.session.flush()
-        test_question = TestQuestion(test_id=test_id, question_id=question.id)
-        db.session.add(test_question)
-
-
-def create_eq_questions(test_id):
-    questions = [
-        (
-            "Для меня как отрицательные, так и положительные эмоции служат источником знания о том, как поступать в жизни.",
-            "awareness"),
-        ("Отрицательные эмоции помогают мне понять, что я должен изменить в своей жизни.", "awareness"),
-        ("Я спокоен, когда испытываю давление со стороны.", "management"),
-        ("Я способен наблюдать изменение своих чувств.", "awareness"),
-        (
-            "Когда необходимо, я могу быть спокойным и сосредоточенным, чтобы действовать в соответствии с запросами жизни.",
-            "management"),
-        (
-            "Когда необходимо, я могу вызвать у себя широкий спектр положительных эмоций, такие, как веселье, радость, внутренний подъем и юмор.",
-            "management"),
-        ("Я слежу за тем, как я себя чувствую.", "awareness"),
-        ("После того как что-то расстроило меня, я могу легко совладать со своими чувствами.", "management"),
-        ("Я способен выслушивать проблемы других людей.", "empathy"),
-        ("Я не зацикливаюсь на отрицательных эмоциях.", "management"),
-        ("Я чувствителен к эмоциональным потребностям других.", "empathy"),
-        ("Я могу действовать на других людей успокаивающе.", "empathy"),
-        ("Я могу заставить себя снова и снова встать перед лицом препятствия.", "motivation"),
-        ("Я стараюсь подходить к жизненным проблемам творчески.", "motivation"),
-        ("Я адекватно реагирую на настроения, побуждения и желания других людей.", "empathy"),
-        ("Я могу легко входить в состояние спокойствия, готовности и сосредоточенности.", "management"),
-        ("Когда позволяет время, я обращаюсь к своим негативным чувствам и разбираюсь, в чем проблема.", "awareness"),
-        ("Я способен быстро успокоиться после неожиданного огорчения.", "management"),
-        ("Знание моих истинных чувств важно для поддержания «хорошей формы».", "awareness"),
-        ("Я хорошо понимаю эмоции других людей, даже если они не выражены открыто.", "recognition"),
-        ("Я могу хорошо распознавать эмоции по выражению лица.", "recognition"),
-        ("Я могу легко отбросить негативные чувства, когда необходимо действовать.", "management"),
-        ("Я хорошо улавливаю знаки в общении, которые указывают на то, в чем другие нуждаются.", "recognition"),
-        ("Люди считают меня хорошим знатоком переживаний других людей.", "empathy"),
-        ("Люди, осознающие свои истинные чувства, лучше управляют своей жизнью.", "awareness"),
-        ("Я способен улучшить настроение других людей.", "empathy"),
-        ("Со мной можно посоветоваться по вопросам отношений между людьми.", "empathy"),
-        ("Я хорошо настраиваюсь на эмоции других людей.", "empathy"),
-        ("Я помогаю другим использовать их побуждения для достижения личных целей.", "motivation"),
-        ("Я могу легко отключиться от переживания неприятностей.", "management")
-    ]
-    for text, category in questions:
-        question = Question(text=text, question_type="eq", category=category)
-        db.session.add(question)
-        db.session.flush()
-        test_question = TestQuestion(test_id=test_id, question_id=question.id)
-        db.session.add(test_question)
+    count = sum(answer.get('count', 1) for answer in answers)
+    return round(sum(answer['value'] for answer in answers) / count, 1)
+
+
+ANSWER_SCALES = {'disc': (1, 5), 'eq': (1, 5)}
+
+DISC_QUESTIONS = [
+    ("Я легко адаптируюсь к новым ситуациям.", "i"),
+    ("Я люблю быть в центре внимания.", "i"),
+    ("Я предпочитаю работать в одиночку.", "s"),
+    ("Я часто беру на себя ответственность в группе.", "d"),
+    ("Я стараюсь избегать конфликтов.", "s"),
+    ("Я быстро принимаю решения.", "d"),
+    ("Я ценю стабильность и предсказуемость.", "s"),
+    ("Я люблю соревноваться и побеждать.", "d"),
+    ("Я часто помогаю другим, даже если это не в моих интересах.", "s"),
+    ("Я легко нахожу общий язык с новыми людьми.", "i"),
+    ("Я предпочитаю тщательно анализировать информацию перед принятием решения.", "c"),
+    ("Я люблю рисковать.", "d"),
+    ("Я стараюсь избегать резких изменений.", "s"),
+    ("Я часто выступаю инициатором новых идей.", "i"),
+    ("Я предпочитаю работать в команде, а не в одиночку.", "i"),
+    ("Я часто ставлю перед собой амбициозные цели.", "d"),
+    ("Я стараюсь избегать конфронтации.", "s"),
+    ("Я люблю, когда всё идет по плану.", "c"),
+    ("Я часто беру на себя роль лидера.", "d"),
+    ("Я ценю гармонию в отношениях.", "s"),
+    ("Я быстро устаю от рутины.", "i"),
+    ("Я предпочитаю действовать, а не долго обсуждать.", "d"),
+    ("Я стараюсь быть дипломатичным в общении.", "s"),
+    ("Я люблю решать сложные задачи.", "c"),
+    ("Я часто сомневаюсь в своих решениях.", "s"),
+    ("Я люблю, когда меня хвалят за мои достижения.", "i"),
+    ("Я предпочитаю следовать правилам.", "c"),
+    ("Я часто ищу новые возможности для роста.", "d"),
+    ("Я стараюсь избегать споров.", "s"),
+    ("Я люблю, когда всё организовано и структурировано.", "c")
+]
+
+EQ_QUESTIONS = [
+    (
+        "Для меня как отрицательные, так и положительные эмоции служат источником знания о том, как поступать в жизни.",
+        "awareness"),
+    ("Отрицательные эмоции помогают мне понять, что я должен изменить в своей жизни.", "awareness"),
+    ("Я спокоен, когда испытываю давление со стороны.", "management"),
+    ("Я способен наблюдать изменение своих чувств.", "awareness"),
+    (
+        "Когда необходимо, я могу быть спокойным и сосредоточенным, чтобы действовать в соответствии с запросами жизни.",
+        "management"),
+    (
+        "Когда необходимо, я могу вызвать у себя широкий спектр положительных эмоций, такие, как веселье, радость, внутренний подъем и юмор.",
+        "management"),
+    ("Я слежу за тем, как я себя чувствую.", "awareness"),
+    ("После того как что-то расстроило меня, я могу легко совладать со своими чувствами.", "management"),
+    ("Я способен выслушивать проблемы других людей.", "empathy"),
+    ("Я не зацикливаюсь на отрицательных эмоциях.", "management"),
+    ("Я чувствителен к эмоциональным потребностям других.", "empathy"),
+    ("Я могу действовать на других людей успокаивающе.", "empathy"),
+    ("Я могу заставить себя снова и снова встать перед лицом препятствия.", "motivation"),
+    ("Я стараюсь подходить к жизненным проблемам творчески.", "motivation"),
+    ("Я адекватно реагирую на настроения, побуждения и желания других людей.", "empathy"),
+    ("Я могу легко входить в состояние спокойствия, готовности и сосредоточенности.", "management"),
+    ("Когда позволяет время, я обращаюсь к своим негативным чувствам и разбираюсь, в чем проблема.", "awareness"),
+    ("Я способен быстро успокоиться после неожиданного огорчения.", "management"),
+    ("Знание моих истинных чувств важно для поддержания «хорошей формы».", "awareness"),
+    ("Я хорошо понимаю эмоции других людей, даже если они не выражены открыто.", "recognition"),
+    ("Я могу хорошо распознавать эмоции по выражению лица.", "recognition"),
+    ("Я могу легко отбросить негативные чувства, когда необходимо действовать.", "management"),
+    ("Я хорошо улавливаю знаки в общении, которые указывают на то, в чем другие нуждаются.", "recognition"),
+    ("Люди считают меня хорошим знатоком переживаний других людей.", "empathy"),
+    ("Люди, осознающие свои истинные чувства, лучше управляют своей жизнью.", "awareness"),
+    ("Я способен улучшить настроение других людей.", "empathy"),
+    ("Со мной можно посоветоваться по вопросам отношений между людьми.", "empathy"),
+    ("Я хорошо настраиваюсь на эмоции других людей.", "empathy"),
+    ("Я помогаю другим использовать их побуждения для достижения личных целей.", "motivation"),
+    ("Я могу легко отключиться от переживания неприятностей.", "management")
+]
+
+
+def question_set_checksum():
+    content = json.dumps({'disc': DISC_QUESTIONS, 'eq': EQ_QUESTIONS}, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+
+def get_question_set_id():
+    global current_question_set_id
+    if current_question_set_id is None:
+        if 'seeded_question_set_id' in db.session.info:
+            return db.session.info['seeded_question_set_id']
+        checksum = question_set_checksum()
+        question_set = QuestionSet.query.filter_by(checksum=checksum).first()
+        if not question_set:
+            question_set = seed_question_set(checksum)
+            db.session.info['seeded_question_set_id'] = question_set.id
+            return question_set.id
+        current_question_set_id = question_set.id
+    return current_question_set_id
+
+
+@event.listens_for(Session, 'after_commit')
+def publish_seeded_question_set(session):
+    global current_question_set_id
+    if 'seeded_question_set_id' in session.info:
+        current_question_set_id = session.info.pop('seeded_question_set_id')
+
+
+@event.listens_for(Session, 'after_rollback')
+def discard_seeded_question_set(session):
+    session.info.pop('seeded_question_set_id', None)
+
+
+def seed_question_set(checksum):
+    version = (db.session.query(db.func.max(QuestionSet.version)).scalar() or 0) + 1
+    question_set = QuestionSet(version=version, checksum=checksum)
+    try:
+        with db.session.begin_nested():
+            db.session.add(question_set)
+            db.session.flush()
+            db.session.execute(db.insert(Question), [
+                {'text': text, 'question_type': question_type, 'category': category,
+                 'question_set_id': question_set.id}
+                for question_type, questions in (('disc', DISC_QUESTIONS), ('eq', EQ_QUESTIONS))
+                for text, category in questions
+            ])
+    except IntegrityError:
+        question_set = QuestionSet.query.filter_by(checksum=checksum).one()
+    return question_set
+
+
+def test_question_ids(test):
+    if test.question_set_id:
+        return db.select(Question.id).where(Question.question_set_id == test.question_set_id)
+    return db.select(TestQuestion.question_id).where(TestQuestion.test_id == test.id)
+
+
+UPSERT_DIALECTS = {'sqlite': sqlite, 'postgresql': postgresql, 'mysql': mysql, 'mariadb': mysql}
+
+
+def upsert_increment_statement(model, rows, index_elements, columns):
+    dialect = db.engine.dialect.name
+    if dialect not in UPSERT_DIALECTS:
+        raise RuntimeError(f"СУБД {dialect} не поддерживается")
+    statement = UPSERT_DIALECTS[dialect].insert(model).values(rows)
+    if UPSERT_DIALECTS[dialect] is mysql:
+        return statement.on_duplicate_key_update(
+            dict({column: getattr(model, column) + statement.inserted[column] for column in columns},
+                 updated_at=db.func.now()))
+    return statement.on_conflict_do_update(
+        index_elements=index_elements,
+        set_=dict({column: getattr(model, column) + statement.excluded[column] for column in columns},
+                  updated_at=db.func.now()))
+
+
+def increment_employee_scores(test, answers):
+    if not answers:
+        return
+    questions = {row.id: (row.question_type, row.category or '') for row in db.session.query(
+        Question.id, Question.question_type, Question.category
+    ).filter(Question.id.in_({answer['question_id'] for answer in answers}),
+             Question.id.in_(test_question_ids(test)))}
+    deltas = {}
+    for answer in answers:
+        if answer['question_id'] not in questions:
+            continue
+        key = (answer['test_id'], answer['user_id']) + questions[answer['question_id']]
+        total, answer_count = deltas.get(key, (0, 0))
+        deltas[key] = (total + answer['value'], answer_count + 1)
+    if not deltas:
+        return
+    db.session.execute(upsert_increment_statement(EmployeeScore, [
+        {'test_id': test_id, 'user_id': user_id, 'question_type': question_type, 'category': category,
+         'total': total, 'answer_count': answer_count}
+        for (test_id, user_id, question_type, category), (total, answer_count) in deltas.items()
+    ], ['test_id', 'user_id', 'question_type', 'category'], ['total', 'answer_count']))
+
+
+def rebuild_employee_scores(test, user_ids=None):
+    stale = EmployeeScore.query.filter_by(test_id=test.id)
+    scores = db.select(
+        Answer.test_id,
+        Answer.user_id,
+        Question.question_type,
+        db.func.coalesce(Question.category, ''),
+        db.func.sum(Answer.value),
+        db.func.count(Answer.id)
+    ).join(
+        Question, Question.id == Answer.question_id
+    ).where(
+        Answer.test_id == test.id,
+        Answer.question_id.in_(test_question_ids(test))
+    ).group_by(Answer.test_id, Answer.user_id, Question.question_type, Question.category)
+    if user_ids is not None:
+        stale = stale.filter(EmployeeScore.user_id.in_(user_ids))
+        scores = scores.where(Answer.user_id.in_(user_ids))
+    stale.delete(synchronize_session=False)
+    db.session.execute(db.insert(EmployeeScore).from_select(
+        ['test_id', 'user_id', 'question_type', 'category', 'total', 'answer_count'], scores))
 
 
 @app.route('/company/dashboard')
@@ -366,20 +1307,31 @@ def company_dashboard():
         flash('Доступ запрещен', 'danger')
         return redirect(url_for('dashboard'))
 
-    active_tests = Test.query.filter(
-        Test.company_id == current_user.id,
+    active_tests = active_tests_query(current_user.id).all()
+    available_reports, reports_cursor = keyset_page(
+        available_reports_query(current_user.id), AnalysisResult.completed_at, AnalysisResult.id, True, None, 5)
+
+    return render_template('company_dashboard.html',
+                           active_tests=active_tests,
+                           available_reports=available_reports,
+                           reports_cursor=reports_cursor,
+                           pdf_available=pdf_available())
+
+
+def active_tests_query(company_id):
+    return Test.query.filter(
+        Test.company_id == company_id,
         Test.is_active == True,
         Test.end_date > datetime.utcnow()
-    ).order_by(Test.end_date).all()
+    ).order_by(Test.end_date)
 
-    available_reports = AnalysisResult.query.filter(
-        AnalysisResult.user_id == current_user.id,
-        AnalysisResult.status == 'completed'
-    ).order_by(desc(AnalysisResult.completed_at)).limit(5).all()
 
-    return render_template('company_dashboard.html',
-                           active_tests=active_tests,
-                           available_reports=available_reports)
+def available_reports_query(user_id):
+    return AnalysisResult.query.filter(
+        AnalysisResult.user_id == user_id,
+        AnalysisResult.status == 'completed',
+        AnalysisResult.draft_for_id.is_(None)
+    )
 
 
 @app.route('/employee/dashboard')
@@ -389,14 +1341,18 @@ def employee_dashboard():
         flash('Доступ запрещен', 'danger')
         return redirect(url_for('dashboard'))
 
-    last_test = db.session.query(Test, Answer).join(
+    last_test = last_finished_test_query(current_user.id).first()
+
+    return render_template('employee_dashboard.html', last_test=last_test)
+
+
+def last_finished_test_query(user_id):
+    return db.session.query(Test, Answer).join(
         Answer, Answer.test_id == Test.id
     ).filter(
-        Answer.user_id == current_user.id,
+        Answer.user_id == user_id,
         Test.is_active == False
-    ).order_by(desc(Test.end_date)).first()
-
-    return render_template('employee_dashboard.html', last_test=last_test)
+    ).order_by(desc(Test.end_date))
 
 
 @app.route('/api/employee/results')
@@ -405,15 +1361,7 @@ def get_employee_results():
     if current_user.role != 'employee':
         return jsonify({'error': 'Доступ запрещен'}), 403
 
-    results = db.session.query(
-        Test.id,
-        Test.end_date,
-        db.func.avg(Answer.value).label('avg_score')
-    ).join(
-        Answer, Answer.test_id == Test.id
-    ).filter(
-        Answer.user_id == current_user.id
-    ).group_by(Test.id).order_by(desc(Test.end_date)).limit(5).all()
+    results = employee_results_query(current_user.id).limit(5).all()
 
     return jsonify([{
         'test_id': r.id,
@@ -422,6 +1370,208 @@ def get_employee_results():
     } for r in results])
 
 
+@app.route('/api/tests/<int:test_id>/answers', methods=['POST'])
+@login_required
+def submit_answers(test_id):
+    if current_user.role != 'employee':
+        return jsonify({'error': 'Доступ запрещен'}), 403
+    test = db.session.get(Test, test_id)
+    if not test:
+        return jsonify({'error': 'Тест не найден'}), 404
+    if db.session.query(User.name).filter_by(id=test.company_id).scalar() != current_user.comp_name:
+        return jsonify({'error': 'Нет доступа к этому тесту'}), 403
+    if not test.is_active or test.end_date < datetime.utcnow():
+        return jsonify({'error': 'Срок тестирования истек'}), 400
+
+    data = request.get_json(silent=True) or {}
+    idempotency_key = request.headers.get('Idempotency-Key') or data.get('idempotency_key')
+    submission = AnswerSubmission.query.filter_by(user_id=current_user.id, test_id=test_id).first()
+    if submission:
+        return answer_submission_response(submission, idempotency_key)
+
+    answers = data.get('answers')
+    if not isinstance(answers, list):
+        return jsonify({'error': 'Ожидается список ответов'}), 400
+    question_types = dict(db.session.query(Question.id, Question.question_type).filter(
+        Question.id.in_(test_question_ids(test))).all())
+    question_ids = set(question_types)
+    rows = []
+    for answer in answers:
+        value = answer.get('value') if isinstance(answer, dict) else None
+        if not isinstance(value, int) or isinstance(value, bool) or answer.get('question_id') not in question_ids:
+            return jsonify({'error': 'Некорректный ответ'}), 400
+        low, high = ANSWER_SCALES[question_types[answer['question_id']]]
+        if not low <= value <= high:
+            return jsonify({'error': f"Ответ должен быть от {low} до {high}"}), 400
+        rows.append({'user_id': current_user.id, 'test_id': test_id, 'question_id': answer['question_id'],
+                     'value': value})
+    if len(rows) != len(question_ids) or {row['question_id'] for row in rows} != question_ids:
+        return jsonify({'error': 'Нужно ответить на все вопросы теста'}), 400
+
+    submission = AnswerSubmission(user_id=current_user.id, test_id=test_id, idempotency_key=idempotency_key,
+                                  answer_count=len(rows))
+    try:
+        db.session.add(submission)
+        db.session.flush()
+    except IntegrityError:
+        db.session.rollback()
+        submission = AnswerSubmission.query.filter_by(user_id=current_user.id, test_id=test_id).one()
+        return answer_submission_response(submission, idempotency_key)
+    db.session.execute(db.insert(Answer), rows)
+    increment_employee_scores(test, rows)
+    db.session.commit()
+    return jsonify({'status': 'saved', 'answers': len(rows)}), 201
+
+
+def answer_submission_response(submission, idempotency_key):
+    if idempotency_key and submission.idempotency_key == idempotency_key:
+        return jsonify({'status': 'saved', 'answers': submission.answer_count, 'replayed': True})
+    return jsonify({'error': 'Ответы на этот тест уже отправлены'}), 409
+
+
+def employee_results_query(user_id):
+    return db.session.query(
+        Test.id,
+        Test.end_date,
+        (db.func.sum(EmployeeScore.total) * 1.0 / db.func.sum(EmployeeScore.answer_count)).label('avg_score')
+    ).join(
+        EmployeeScore, EmployeeScore.test_id == Test.id
+    ).filter(
+        EmployeeScore.user_id == user_id
+    ).group_by(Test.id).order_by(desc(Test.end_date))
+
+
+@app.route('/api/analytics/team')
+@login_required
+def team_trends():
+    if current_user.role != 'company':
+        return jsonify({'error': 'Доступ запрещен'}), 403
+    tests = trend_tests(recent_company_tests_query(current_user.id, trend_tests_limit()))
+    rows = team_trends_query([test.id for test in tests], current_user.name).all()
+    participants = {}
+    for row in rows:
+        participants[row.test_id] = max(participants.get(row.test_id, 0), row.participants)
+    return jsonify({'tests': serialize_trend_tests(tests, participants), 'metrics': build_trend_series(rows, tests)})
+
+
+@app.route('/api/analytics/employees')
+@login_required
+def employees_trends():
+    if current_user.role != 'company':
+        return jsonify({'error': 'Доступ запрещен'}), 403
+    tests = trend_tests(recent_company_tests_query(current_user.id, trend_tests_limit()))
+    rows = employee_trends_query([test.id for test in tests], current_user.name,
+                                 request.args.get('user_id', type=int)).all()
+    return jsonify({'tests': serialize_trend_tests(tests), 'employees': group_employee_trends(rows, tests)})
+
+
+@app.route('/api/employee/trends')
+@login_required
+def employee_trends():
+    if current_user.role != 'employee':
+        return jsonify({'error': 'Доступ запрещен'}), 403
+    tests = trend_tests(recent_employee_tests_query(current_user.id, trend_tests_limit()))
+    rows = employee_trends_query([test.id for test in tests], current_user.comp_name, current_user.id).all()
+    employees = group_employee_trends(rows, tests)
+    return jsonify({'tests': serialize_trend_tests(tests), 'metrics': employees[0]['metrics'] if employees else {}})
+
+
+def trend_tests_limit():
+    return min(max(request.args.get('tests', 10, type=int), 1), app.config['ANALYTICS_MAX_TESTS'])
+
+
+def recent_company_tests_query(company_id, limit):
+    return Test.query.filter(Test.company_id == company_id).order_by(desc(Test.end_date), desc(Test.id)).limit(limit)
+
+
+def recent_employee_tests_query(user_id, limit):
+    return Test.query.filter(
+        Test.id.in_(db.select(Answer.test_id).where(Answer.user_id == user_id))
+    ).order_by(desc(Test.end_date), desc(Test.id)).limit(limit)
+
+
+def trend_tests(query):
+    return query.all()[::-1]
+
+
+def score_metrics_query(test_ids, comp_name, user_id=None):
+    def scoped(query):
+        query = query.join(User, User.id == EmployeeScore.user_id).where(
+            EmployeeScore.test_id.in_(test_ids), User.comp_name == comp_name, User.role == 'employee')
+        return query.where(EmployeeScore.user_id == user_id) if user_id is not None else query
+
+    type_total = db.func.sum(EmployeeScore.total).over(
+        partition_by=(EmployeeScore.test_id, EmployeeScore.user_id, EmployeeScore.question_type))
+    categories = scoped(db.select(
+        EmployeeScore.test_id,
+        EmployeeScore.user_id,
+        (EmployeeScore.question_type + ':' + EmployeeScore.category).label('metric'),
+        db.case(
+            (EmployeeScore.question_type == 'disc', EmployeeScore.total * 100.0 / db.func.nullif(type_total, 0)),
+            else_=EmployeeScore.total * 1.0 / db.func.nullif(EmployeeScore.answer_count, 0)
+        ).label('value')
+    ))
+    eq_total = scoped(db.select(
+        EmployeeScore.test_id,
+        EmployeeScore.user_id,
+        db.literal('eq:total').label('metric'),
+        (db.func.sum(EmployeeScore.total) * 1.0 / db.func.nullif(db.func.sum(EmployeeScore.answer_count), 0))
+        .label('value')
+    ).where(EmployeeScore.question_type == 'eq').group_by(EmployeeScore.test_id, EmployeeScore.user_id))
+    return db.union_all(categories, eq_total).subquery()
+
+
+def employee_trends_query(test_ids, comp_name, user_id=None):
+    scores = score_metrics_query(test_ids, comp_name, user_id)
+    previous = db.func.lag(scores.c.value).over(partition_by=(scores.c.user_id, scores.c.metric),
+                                                order_by=(Test.end_date, Test.id))
+    return db.session.query(
+        scores.c.user_id,
+        User.name,
+        scores.c.test_id,
+        scores.c.metric,
+        db.func.round(scores.c.value, 1).label('value'),
+        db.func.round(scores.c.value - previous, 1).label('delta')
+    ).join(Test, Test.id == scores.c.test_id).join(User, User.id == scores.c.user_id).order_by(User.name, User.id)
+
+
+def team_trends_query(test_ids, comp_name):
+    scores = score_metrics_query(test_ids, comp_name)
+    average = db.func.avg(scores.c.value)
+    return db.session.query(
+        scores.c.test_id,
+        scores.c.metric,
+        db.func.round(average, 1).label('value'),
+        db.func.round(average - db.func.lag(average).over(partition_by=scores.c.metric,
+                                                          order_by=(Test.end_date, Test.id)), 1).label('delta'),
+        db.func.count(db.distinct(scores.c.user_id)).label('participants')
+    ).join(Test, Test.id == scores.c.test_id).group_by(scores.c.test_id, scores.c.metric, Test.end_date, Test.id)
+
+
+def serialize_trend_tests(tests, participants=None):
+    return [dict({'id': test.id, 'end_date': test.end_date.strftime('%Y-%m-%d')},
+                 **({'participants': participants.get(test.id, 0)} if participants is not None else {}))
+            for test in tests]
+
+
+def build_trend_series(rows, tests):
+    positions = {test.id: i for i, test in enumerate(tests)}
+    series = {}
+    for row in rows:
+        metric = series.setdefault(row.metric, {'values': [None] * len(tests), 'deltas': [None] * len(tests)})
+        metric['values'][positions[row.test_id]] = row.value
+        metric['deltas'][positions[row.test_id]] = row.delta
+    return series
+
+
+def group_employee_trends(rows, tests):
+    employees = {}
+    for row in rows:
+        employees.setdefault(row.user_id, {'id': row.user_id, 'name': row.name, 'rows': []})['rows'].append(row)
+    return [{'id': employee['id'], 'name': employee['name'], 'metrics': build_trend_series(employee['rows'], tests)}
+            for employee in employees.values()]
+
+
 @app.route('/')
 def index():
     return render_template('index.html')
@@ -431,11 +1581,14 @@ def index():
 def register():
     form = RegisterForm()
     if form.validate_on_submit():
+        if find_user_by_email(form.email.data):
+            flash('Email уже зарегистрирован', 'danger')
+            return render_template('register.html', form=form)
         try:
             hashed_password = generate_password_hash(form.password.data)
             user = User(role=form.role.data, name=form.name.data,
-                        comp_name=form.comp_name.data if form.role.data == 'employee' else None, email=form.email.data,
-                        password=hashed_password)
+                        comp_name=form.comp_name.data if form.role.data == 'employee' else None,
+                        email=normalize_email(form.email.data), password=hashed_password)
             db.session.add(user)
             db.session.commit()
             flash('Регистрация успешна! Теперь войдите.', 'success')
@@ -450,7 +1603,7 @@ def register():
 def login():
     form = LoginForm()
     if form.validate_on_submit():
-        user = User.query.filter_by(email=form.email.data).first()
+        user = find_user_by_email(form.email.data)
         if user and check_password_hash(user.password, form.password.data):
             login_user(user)
             return redirect(url_for('dashboard'))
@@ -458,6 +1611,14 @@ def login():
     return render_template('login.html', form=form)
 
 
+def normalize_email(email):
+    return email.strip().lower()
+
+
+def find_user_by_email(email):
+    return User.query.filter(db.func.lower(User.email) == normalize_email(email)).first()
+
+
 @app.route('/dashboard')
 @login_required
 def dashboard():
@@ -480,8 +1641,252 @@ def view_employees():
     if current_user.role != 'company':
         flash('Доступ запрещен', 'danger')
         return redirect(url_for('dashboard'))
-    employees = User.query.filter_by(comp_name=current_user.name, role='employee').all()
-    return render_template('employees.html', employees=employees)
+    return render_template('employees.html')
+
+
+@app.route('/api/employees/import', methods=['POST'])
+@login_required
+def import_employees_upload():
+    if current_user.role != 'company':
+        return jsonify({'error': 'Доступ запрещен'}), 403
+    upload = request.files.get('file')
+    try:
+        if upload:
+            records = parse_employee_records(upload.filename, upload.read())
+        else:
+            data = request.get_json(silent=True)
+            records = data.get('employees') if isinstance(data, dict) else data
+            if not isinstance(records, list):
+                raise ValueError('Ожидается файл CSV/JSON или список сотрудников')
+        test_expires = parse_test_expires(request.values.get('test_expires'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if len(records) > app.config['IMPORT_MAX_ROWS']:
+        return jsonify({'error': f"Не более {app.config['IMPORT_MAX_ROWS']} сотрудников за одну загрузку"}), 400
+    report = import_employees(records, current_user.name, request.values.get('test_link'), test_expires)
+    return jsonify(report), 201 if report['created'] else 200
+
+
+def parse_employee_records(filename, content):
+    text = content.decode('utf-8-sig') if isinstance(content, bytes) else content
+    if (filename or '').lower().endswith('.json'):
+        data = json.loads(text)
+        records = data.get('employees') if isinstance(data, dict) else data
+        if not isinstance(records, list):
+            raise ValueError('JSON должен содержать список сотрудников')
+        return records
+    if not (filename or '').lower().endswith('.csv'):
+        raise ValueError('Поддерживаются только файлы CSV и JSON')
+    return list(csv.DictReader(io.StringIO(text)))
+
+
+def parse_test_expires(value):
+    if not value:
+        return None
+    try:
+        return datetime.combine(datetime.strptime(value, '%Y-%m-%d').date(), datetime.max.time())
+    except ValueError:
+        raise ValueError('Дата окончания теста должна быть в формате ГГГГ-ММ-ДД')
+
+
+def validate_employee_record(record, test_link, test_expires):
+    if not isinstance(record, dict):
+        raise ValueError('Некорректная строка')
+    name, email, password = (record.get(field) or '' for field in ('name', 'email', 'password'))
+    if not all(isinstance(value, str) for value in (name, email, password)):
+        raise ValueError('Имя, email и пароль должны быть строками')
+    name = name.strip()
+    email = normalize_email(email)
+    if not 2 <= len(name) <= 100:
+        raise ValueError('Имя должно содержать от 2 до 100 символов')
+    if not email or '@' not in email or len(email) > 100:
+        raise ValueError('Некорректный email')
+    if len(password) < 8:
+        raise ValueError('Пароль должен содержать не менее 8 символов')
+    return {'name': name, 'email': email, 'password': password,
+            'test_link': record.get('test_link') or test_link,
+            'test_expires': parse_test_expires(record.get('test_expires')) or test_expires}
+
+
+def import_employees(records, comp_name, test_link=None, test_expires=None):
+    errors = []
+    valid = []
+    seen = set()
+    for row, record in enumerate(records, start=1):
+        try:
+            employee = validate_employee_record(record, test_link, test_expires)
+            if employee['email'] in seen:
+                raise ValueError('Email повторяется в загрузке')
+        except ValueError as e:
+            errors.append({'row': row, 'email': record.get('email') if isinstance(record, dict) else None,
+                           'error': str(e)})
+            continue
+        seen.add(employee['email'])
+        valid.append((row, employee))
+    batch_size = app.config['IMPORT_BATCH_SIZE']
+    existing = set()
+    emails = [employee['email'] for row, employee in valid]
+    for start in range(0, len(emails), batch_size):
+        existing.update(email for email, in db.session.query(db.func.lower(User.email)).filter(
+            db.func.lower(User.email).in_(emails[start:start + batch_size])))
+    pending = []
+    for row, employee in valid:
+        if employee['email'] in existing:
+            errors.append({'row': row, 'email': employee['email'], 'error': 'Email уже зарегистрирован'})
+        else:
+            pending.append((row, employee))
+    hashes = hash_passwords([employee['password'] for row, employee in pending])
+    created = 0
+    for start in range(0, len(pending), batch_size):
+        batch = [(row, dict(employee, password=password_hash, role='employee', comp_name=comp_name))
+                 for (row, employee), password_hash in zip(pending[start:start + batch_size],
+                                                           hashes[start:start + batch_size])]
+        created += insert_employee_batch(batch, errors)
+    identity_cache.delete(('roster', comp_name))
+    errors.sort(key=lambda error: error['row'])
+    return {'created': created, 'failed': len(errors), 'errors': errors}
+
+
+def hash_passwords(passwords):
+    if len(passwords) < app.config['IMPORT_PARALLEL_THRESHOLD']:
+        return [generate_password_hash(password) for password in passwords]
+    workers = app.config['IMPORT_HASH_WORKERS'] or os.cpu_count()
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as executor:
+        return list(executor.map(generate_password_hash, passwords,
+                                 chunksize=max(1, len(passwords) // (workers * 4))))
+
+
+def insert_employee_batch(batch, errors):
+    try:
+        db.session.execute(db.insert(User), [employee for row, employee in batch])
+        db.session.commit()
+        return len(batch)
+    except IntegrityError:
+        db.session.rollback()
+    created = 0
+    for row, employee in batch:
+        try:
+            db.session.execute(db.insert(User), [employee])
+            db.session.commit()
+            created += 1
+        except IntegrityError:
+            db.session.rollback()
+            errors.append({'row': row, 'email': employee['email'], 'error': 'Email уже зарегистрирован'})
+    return created
+
+
+def company_employees_query(comp_name):
+    return User.query.filter_by(comp_name=comp_name, role='employee')
+
+
+def encode_cursor(value, row_id):
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    return base64.urlsafe_b64encode(json.dumps([value, row_id]).encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor, sort_column):
+    value, row_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    if isinstance(sort_column.type, db.DateTime):
+        value = datetime.fromisoformat(value)
+    return value, int(row_id)
+
+
+def keyset_query(query, sort_column, id_column, descending, cursor, limit):
+    if cursor:
+        value, row_id = decode_cursor(cursor, sort_column)
+        if descending:
+            query = query.filter(db.or_(sort_column < value, db.and_(sort_column == value, id_column < row_id)))
+        else:
+            query = query.filter(db.or_(sort_column > value, db.and_(sort_column == value, id_column > row_id)))
+    order = (desc(sort_column), desc(id_column)) if descending else (sort_column, id_column)
+    return query.order_by(*order).limit(limit + 1)
+
+
+def keyset_page(query, sort_column, id_column, descending, cursor, limit):
+    rows = keyset_query(query, sort_column, id_column, descending, cursor, limit).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(getattr(rows[-1], sort_column.key), getattr(rows[-1], id_column.key))
+    return rows, next_cursor
+
+
+def page_request_args(sorts, default_sort):
+    sort = request.args.get('sort', default_sort)
+    if sort not in sorts:
+        raise ValueError('Некорректная сортировка')
+    limit = min(max(request.args.get('limit', 50, type=int), 1), app.config['PAGE_MAX_LIMIT'])
+    return sorts[sort], request.args.get('cursor'), limit
+
+
+def paginated_response(query, sorts, default_sort, id_column, serialize):
+    try:
+        (sort_column, descending), cursor, limit = page_request_args(sorts, default_sort)
+        rows, next_cursor = keyset_page(query, sort_column, id_column, descending, cursor, limit)
+    except (ValueError, TypeError):
+        return jsonify({'error': 'Некорректные параметры страницы'}), 400
+    return jsonify({'items': [serialize(row) for row in rows], 'next_cursor': next_cursor})
+
+
+def company_tests_query(company_id):
+    return Test.query.filter(Test.company_id == company_id)
+
+
+def company_analyses_query(user_id):
+    return AnalysisResult.query.filter(AnalysisResult.user_id == user_id)
+
+
+def analysis_results_query(user_id, status=None, include_drafts=False):
+    query = company_analyses_query(user_id)
+    if not include_drafts:
+        query = query.filter(AnalysisResult.draft_for_id.is_(None))
+    if status:
+        query = query.filter(AnalysisResult.status == status)
+    return query
+
+
+@app.route('/api/employees')
+@login_required
+def api_employees():
+    if current_user.role != 'company':
+        return jsonify({'error': 'Доступ запрещен'}), 403
+    query = company_employees_query(current_user.name)
+    name_prefix = request.args.get('q')
+    if name_prefix:
+        query = query.filter(User.name >= name_prefix, User.name < name_prefix + '\uffff')
+    return paginated_response(query, {'name': (User.name, False), 'id': (User.id, False)}, 'name', User.id,
+                              lambda user: {'id': user.id, 'name': user.name, 'email': user.email})
+
+
+@app.route('/api/tests')
+@login_required
+def api_tests():
+    if current_user.role != 'company':
+        return jsonify({'error': 'Доступ запрещен'}), 403
+    query = company_tests_query(current_user.id)
+    if request.args.get('active') == '1':
+        query = query.filter(Test.is_active == True, Test.end_date > datetime.utcnow())
+    return paginated_response(query, {'end_date': (Test.end_date, False), 'created': (Test.id, True)}, 'created',
+                              Test.id, lambda test: {'id': test.id, 'end_date': test.end_date.strftime('%Y-%m-%d'),
+                                                     'is_active': test.is_active})
+
+
+@app.route('/api/analysis_results')
+@login_required
+def api_analysis_results():
+    if current_user.role != 'company':
+        return jsonify({'error': 'Доступ запрещен'}), 403
+    status = request.args.get('status')
+    if request.args.get('sort') == 'completed':
+        status = 'completed'
+    query = analysis_results_query(current_user.id, status, request.args.get('drafts') == '1')
+    return paginated_response(
+        query, {'completed': (AnalysisResult.completed_at, True), 'created': (AnalysisResult.id, True)}, 'created',
+        AnalysisResult.id, lambda analysis: {
+            'id': analysis.id, 'test_id': analysis.test_id, 'status': analysis.status, 'model': analysis.model,
+            'draft_for_id': analysis.draft_for_id,
+            'completed_at': analysis.completed_at.strftime('%d.%m.%Y') if analysis.completed_at else None})
 
 
 @app.route('/create_test', methods=['GET', 'POST'])
@@ -494,11 +1899,9 @@ def create_test():
     if form.validate_on_submit():
         try:
             end_date = datetime.combine(form.end_date.data, datetime.max.time())
-            test = Test(company_id=current_user.id, end_date=end_date, is_active=True)
+            test = Test(company_id=current_user.id, end_date=end_date, is_active=True,
+                        question_set_id=get_question_set_id())
             db.session.add(test)
-            db.session.flush()
-            create_disc_questions(test.id)
-            create_eq_questions(test.id)
             db.session.commit()
             flash('Тестирование успешно создано!', 'success')
             return redirect(url_for('dashboard'))
@@ -515,31 +1918,316 @@ def start_deepseek_analysis():
         return jsonify({"error": "Доступ запрещен"}), 403
     test_id = request.json.get('test_id')
     test_data = prepare_test_data(test_id)
-    analysis = AnalysisResult(test_id=test_id, user_id=current_user.id, status='processing', model=DEEPSEEK_MODEL)
+    model = route_analysis_model(test_data)
+    cached = get_cached_analysis(test_data, model)
+    if cached is not None:
+        analysis = AnalysisResult(test_id=test_id, user_id=current_user.id, status='processing', model=model,
+                                  payload=json.dumps(test_data, ensure_ascii=False))
+        db.session.add(analysis)
+        db.session.flush()
+        complete_analysis(analysis, cached)
+        db.session.commit()
+        return jsonify({"status": "completed", "analysis_id": analysis.id, "model": model})
+    analysis, draft = enqueue_analysis(test_id, current_user.id, test_data, model)
+    return jsonify({"status": "queued", "analysis_id": analysis.id, "model": model,
+                    "draft_id": draft.id if draft else None, "draft_model": draft.model if draft else None})
+
+
+def run_deepseek_analysis(analysis):
+    if ollama_breaker.is_open:
+        raise OllamaUnavailable("Ollama недоступна")
+    test_data = json.loads(analysis.payload)
+    result = analyze_with_deepseek(
+        test_data, lambda tokens, delta: publish_analysis_progress(analysis.id, tokens, delta), analysis.model)
+    if 'error' in result:
+        raise Exception(result['error'])
+    return result
+
+
+def complete_analysis(analysis, result):
+    analysis.status = 'completed'
+    analysis.result_data = json.dumps(result, ensure_ascii=False)
+    analysis.completed_at = datetime.utcnow()
+    analysis.error = None
+
+
+analysis_queue_event = Event()
+analysis_progress = {}
+analysis_progress_versions = count(1)
+analysis_progress_condition = Condition()
+analysis_progress_listeners = []
+analysis_workers = []
+analysis_workers_lock = Lock()
+
+
+def enqueue_analysis(test_id, user_id, test_data, model=DEEPSEEK_MODEL):
+    payload = json.dumps(test_data, ensure_ascii=False)
+    analysis = AnalysisResult(test_id=test_id, user_id=user_id, status='queued', model=model, payload=payload)
     db.session.add(analysis)
+    draft = None
+    draft_model = draft_analysis_model(model)
+    if draft_model:
+        db.session.flush()
+        draft = AnalysisResult(test_id=test_id, user_id=user_id, status='queued', model=draft_model, payload=payload,
+                               draft_for_id=analysis.id)
+        db.session.add(draft)
     db.session.commit()
-    Thread(target=run_deepseek_analysis, args=(test_data, analysis.id)).start()
-    return jsonify({"status": "started", "analysis_id": analysis.id})
+    start_analysis_workers()
+    analysis_queue_event.set()
+    return analysis, draft
+
+
+def claimable_analysis_jobs_query(now, allow_scheduled=True):
+    running = db.session.query(
+        AnalysisResult.user_id,
+        db.func.count(AnalysisResult.id).label('running')
+    ).filter(AnalysisResult.status == 'processing').group_by(AnalysisResult.user_id).subquery()
+    main = db.aliased(AnalysisResult)
+    query = db.session.query(AnalysisResult.id).outerjoin(
+        running, running.c.user_id == AnalysisResult.user_id
+    ).outerjoin(
+        main, main.id == AnalysisResult.draft_for_id
+    ).filter(
+        AnalysisResult.status == 'queued',
+        db.or_(main.id.is_(None), main.status != 'completed'),
+        db.or_(AnalysisResult.next_attempt_at.is_(None), AnalysisResult.next_attempt_at <= now)
+    )
+    if not allow_scheduled:
+        query = query.filter(AnalysisResult.scheduled == False)
+    return query.order_by(AnalysisResult.scheduled, db.func.coalesce(running.c.running, 0),
+                          AnalysisResult.draft_for_id.is_(None), AnalysisResult.id)
+
+
+def scheduled_analyses_allowed():
+    if not in_off_peak_window(datetime.now()):
+        return False
+    running = AnalysisResult.query.filter_by(status='processing', scheduled=True).count()
+    return running < app.config['SCHEDULED_ANALYSIS_CONCURRENCY']
+
+
+def claim_analysis_job():
+    now = datetime.utcnow()
+    candidates = claimable_analysis_jobs_query(now, scheduled_analyses_allowed()).limit(
+        app.config['ANALYSIS_WORKERS']).all()
+    running = db.aliased(AnalysisResult)
+    scheduled_running = db.select(db.func.count(running.id)).where(
+        running.scheduled == True, running.status == 'processing').scalar_subquery()
+    for candidate in candidates:
+        claimed = run_with_db_retry(lambda: AnalysisResult.query.filter(
+            AnalysisResult.id == candidate.id,
+            AnalysisResult.status == 'queued',
+            db.or_(AnalysisResult.scheduled == False,
+                   scheduled_running < app.config['SCHEDULED_ANALYSIS_CONCURRENCY'])
+        ).update({'status': 'processing', 'started_at': now, 'heartbeat_at': now,
+                  'attempts': AnalysisResult.attempts + 1},
+                 synchronize_session=False))
+        if claimed:
+            return db.session.get(AnalysisResult, candidate.id)
+    return None
+
+
+def process_analysis_job(analysis):
+    analysis_id, payload, attempts, model = analysis.id, analysis.payload, analysis.attempts, analysis.model
+    stop_heartbeat = Event()
+    Thread(target=analysis_heartbeat, args=(analysis_id, stop_heartbeat), daemon=True).start()
+    try:
+        result = run_deepseek_analysis(analysis)
+        run_with_db_retry(lambda: save_completed_analysis(analysis_id, payload, result, model))
+    except OllamaUnavailable as e:
+        db.session.rollback()
+        app.logger.warning(f"Задача анализа {analysis_id} возвращена в очередь: {str(e)}")
+        run_with_db_retry(lambda: release_analysis_job(analysis_id))
+    except Exception as e:
+        db.session.rollback()
+        app.logger.exception(f"Ошибка задачи анализа {analysis_id}: {str(e)}")
+        run_with_db_retry(lambda: save_failed_analysis(analysis_id, attempts, str(e)))
+    finally:
+        stop_heartbeat.set()
+    finish_analysis_progress(analysis_id)
 
 
-def run_deepseek_analysis(test_data, analysis_id):
-    with app.app_context():
-        analysis = AnalysisResult.query.get(analysis_id)
+def analysis_heartbeat(analysis_id, stop):
+    while not stop.wait(app.config['ANALYSIS_HEARTBEAT_INTERVAL']):
         try:
-            result = analyze_with_deepseek(test_data)
-            if 'error' in result:
-                raise Exception(result['error'])
-            report = generate_team_report(result)
-            report_filename = f"report_{analysis_id}.md"
-            save_report(report, report_filename)
-            analysis.status = 'completed'
-            analysis.result_data = json.dumps(result, ensure_ascii=False)
-            analysis.report_filename = report_filename
-            analysis.completed_at = datetime.utcnow()
+            with app.app_context():
+                run_with_db_retry(lambda: AnalysisResult.query.filter_by(id=analysis_id, status='processing').update(
+                    {'heartbeat_at': datetime.utcnow()}, synchronize_session=False))
         except Exception as e:
-            analysis.status = 'failed'
-            analysis.error = str(e)
-        db.session.commit()
+            app.logger.exception(f"Не удалось продлить аренду анализа {analysis_id}: {str(e)}")
+
+
+def save_completed_analysis(analysis_id, payload, result, model=DEEPSEEK_MODEL):
+    analysis = db.session.get(AnalysisResult, analysis_id, populate_existing=True)
+    if analysis.draft_for_id is not None and analysis.status == 'failed':
+        return
+    complete_analysis(analysis, result)
+    if analysis.draft_for_id is None:
+        cancel_analysis_drafts(analysis_id)
+    store_cached_analysis(json.loads(payload), result, model)
+
+
+def cancel_analysis_drafts(analysis_id):
+    AnalysisResult.query.filter(
+        AnalysisResult.draft_for_id == analysis_id,
+        AnalysisResult.status.in_(('queued', 'processing'))
+    ).update({'status': 'failed', 'error': 'Черновик заменен основным анализом'}, synchronize_session=False)
+
+
+def release_analysis_job(analysis_id):
+    AnalysisResult.query.filter_by(id=analysis_id, status='processing').update(
+        {'status': 'queued', 'attempts': AnalysisResult.attempts - 1, 'started_at': None, 'heartbeat_at': None},
+        synchronize_session=False)
+
+
+def save_failed_analysis(analysis_id, attempts, error):
+    analysis = db.session.get(AnalysisResult, analysis_id, populate_existing=True)
+    if analysis.draft_for_id is not None and analysis.status == 'failed':
+        return
+    if attempts < app.config['ANALYSIS_MAX_ATTEMPTS']:
+        delay = app.config['ANALYSIS_RETRY_DELAY'] * 2 ** (attempts - 1)
+        analysis.status = 'queued'
+        analysis.next_attempt_at = datetime.utcnow() + timedelta(seconds=delay)
+    else:
+        analysis.status = 'failed'
+    analysis.error = error
+
+
+def publish_analysis_progress(analysis_id, tokens, delta):
+    with analysis_progress_condition:
+        state = analysis_progress.setdefault(analysis_id, {'partial': ''})
+        state['tokens'] = tokens
+        state['partial'] += delta
+        state['version'] = next(analysis_progress_versions)
+        analysis_progress_condition.notify_all()
+    notify_analysis_progress_listeners(analysis_id)
+
+
+def finish_analysis_progress(analysis_id):
+    with analysis_progress_condition:
+        analysis_progress.pop(analysis_id, None)
+        analysis_progress_condition.notify_all()
+    notify_analysis_progress_listeners(analysis_id)
+
+
+def notify_analysis_progress_listeners(analysis_id):
+    for listener in list(analysis_progress_listeners):
+        listener(analysis_id)
+
+
+def recover_analysis_jobs():
+    return run_with_db_retry(requeue_stale_analysis_jobs)
+
+
+def requeue_stale_analysis_jobs():
+    now = datetime.utcnow()
+    stale = db.or_(AnalysisResult.started_at.is_(None),
+                   AnalysisResult.started_at < now - timedelta(seconds=app.config['ANALYSIS_JOB_TIMEOUT']),
+                   db.func.coalesce(AnalysisResult.heartbeat_at, AnalysisResult.started_at)
+                   < now - timedelta(seconds=app.config['ANALYSIS_LEASE_TIMEOUT']))
+    AnalysisResult.query.filter(
+        AnalysisResult.status == 'processing', stale,
+        db.or_(AnalysisResult.payload.is_(None), AnalysisResult.attempts >= app.config['ANALYSIS_MAX_ATTEMPTS'])
+    ).update({'status': 'failed', 'error': 'Анализ прерван'}, synchronize_session=False)
+    return AnalysisResult.query.filter(AnalysisResult.status == 'processing', stale).update(
+        {'status': 'queued', 'next_attempt_at': None}, synchronize_session=False)
+
+
+def analysis_worker():
+    while True:
+        analysis_queue_event.clear()
+        try:
+            with app.app_context():
+                analysis = None if ollama_breaker.is_open else claim_analysis_job()
+                if analysis:
+                    process_analysis_job(analysis)
+                    continue
+                recover_analysis_jobs()
+        except Exception as e:
+            app.logger.exception(f"Ошибка очереди анализа: {str(e)}")
+        analysis_queue_event.wait(app.config['ANALYSIS_POLL_INTERVAL'])
+
+
+def start_analysis_workers():
+    with analysis_workers_lock:
+        if analysis_workers:
+            return
+        if app.config['OLLAMA_WARMUP'] and app.config['ANALYSIS_WORKERS']:
+            Thread(target=warm_up_models, daemon=True).start()
+        for _ in range(app.config['ANALYSIS_WORKERS']):
+            worker = Thread(target=analysis_worker, daemon=True)
+            worker.start()
+            analysis_workers.append(worker)
+        if app.config['SCHEDULER_ENABLED'] and app.config['ANALYSIS_WORKERS']:
+            scheduler = Thread(target=test_scheduler, daemon=True)
+            scheduler.start()
+            analysis_workers.append(scheduler)
+
+
+def test_scheduler():
+    while True:
+        try:
+            with app.app_context():
+                close_expired_tests()
+        except Exception as e:
+            app.logger.exception(f"Ошибка планировщика тестов: {str(e)}")
+        time.sleep(app.config['SCHEDULER_INTERVAL'])
+
+
+def expired_tests_query(now):
+    return db.session.query(Test.id).filter(Test.is_active == True, Test.end_date <= now)
+
+
+def close_expired_tests():
+    closed = 0
+    for test_id, in expired_tests_query(datetime.utcnow()).all():
+        if run_with_db_retry(lambda: close_test(test_id)):
+            closed += 1
+    if closed:
+        analysis_queue_event.set()
+    return closed
+
+
+def close_test(test_id):
+    closed = Test.query.filter_by(id=test_id, is_active=True).update({'is_active': False},
+                                                                     synchronize_session=False)
+    if not closed:
+        return None
+    test = db.session.get(Test, test_id)
+    analysis = None
+    already_analyzed = db.session.query(AnalysisResult.query.filter(
+        AnalysisResult.test_id == test.id,
+        AnalysisResult.draft_for_id.is_(None),
+        AnalysisResult.status != 'failed'
+    ).exists()).scalar()
+    company = db.session.get(User, test.company_id)
+    if not already_analyzed and company:
+        test_data = build_test_data(test, company.name)
+        if test_data['disc_results'] or test_data['eq_results']:
+            model = route_analysis_model(test_data)
+            cached = get_cached_analysis(test_data, model)
+            analysis = AnalysisResult(test_id=test.id, user_id=company.id, status='queued', model=model,
+                                      payload=json.dumps(test_data, ensure_ascii=False), scheduled=True)
+            db.session.add(analysis)
+            if cached is not None:
+                complete_analysis(analysis, cached)
+    return test, analysis
+
+
+def parse_time_windows(spec):
+    windows = []
+    for window in filter(None, (part.strip() for part in spec.split(','))):
+        start, end = window.split('-')
+        windows.append((datetime.strptime(start.strip(), '%H:%M').time(), datetime.strptime(end.strip(), '%H:%M').time()))
+    return windows
+
+
+def in_off_peak_window(now):
+    windows = parse_time_windows(app.config['OFF_PEAK_WINDOWS'])
+    if not windows:
+        return True
+    current = now.time()
+    return any(start <= current < end if start <= end else current >= start or current < end
+               for start, end in windows)
 
 
 @app.route('/api/analysis_status/<int:analysis_id>')
@@ -548,13 +2236,59 @@ def analysis_status(analysis_id):
     analysis = AnalysisResult.query.get_or_404(analysis_id)
     if analysis.user_id != current_user.id:
         return jsonify({"error": "Доступ запрещен"}), 403
+    payload, status_code = analysis_status_payload(analysis)
+    return jsonify(payload), status_code
+
+
+def analysis_status_payload(analysis):
     if analysis.status == 'completed':
-        return jsonify({"completed": True, "progress": 100, "message": "Анализ завершен",
-                        "result": json.loads(analysis.result_data)})
+        return {"completed": True, "progress": 100, "message": "Анализ завершен", "model": analysis.model,
+                "draft": analysis.draft_for_id is not None, "result": json.loads(analysis.result_data)}, 200
     elif analysis.status == 'failed':
-        return jsonify({"error": analysis.error or "Ошибка анализа"}), 500
-    progress = min(90, int((datetime.utcnow() - analysis.created_at).total_seconds() / 60 * 10))
-    return jsonify({"completed": False, "progress": progress, "message": "Идет анализ данных..."})
+        return {"error": analysis.error or "Ошибка анализа"}, 500
+    elif analysis.status == 'queued':
+        return {"completed": False, "progress": 0, "message": "Анализ в очереди..."}, 200
+    progress = min(90, int((datetime.utcnow() - (analysis.started_at or analysis.created_at)).total_seconds() / 60 * 10))
+    return {"completed": False, "progress": progress, "message": "Идет анализ данных..."}, 200
+
+
+@app.route('/api/analysis_stream/<int:analysis_id>')
+@login_required
+def analysis_stream(analysis_id):
+    analysis = AnalysisResult.query.get_or_404(analysis_id)
+    if analysis.user_id != current_user.id:
+        return jsonify({"error": "Доступ запрещен"}), 403
+
+    def events():
+        version = 0
+        sent = 0
+        while True:
+            with analysis_progress_condition:
+                analysis_progress_condition.wait_for(
+                    lambda: analysis_progress.get(analysis_id, {}).get('version') != version,
+                    timeout=app.config['ANALYSIS_STREAM_KEEPALIVE'])
+                state = dict(analysis_progress.get(analysis_id, {}))
+            if state and state['version'] != version:
+                version = state['version']
+                progress = min(95, int(state['tokens'] * 100 / app.config['ANALYSIS_EXPECTED_TOKENS']))
+                yield "data: " + json.dumps({"completed": False, "progress": progress, "tokens": state['tokens'],
+                                             "delta": state['partial'][sent:],
+                                             "message": "Идет анализ данных..."}, ensure_ascii=False) + "\n\n"
+                sent = len(state['partial'])
+                continue
+            if state:
+                yield ": keep-alive\n\n"
+                continue
+            version = None
+            sent = 0
+            with app.app_context():
+                payload, status_code = analysis_status_payload(db.session.get(AnalysisResult, analysis_id))
+            yield "data: " + json.dumps(payload, ensure_ascii=False) + "\n\n"
+            if payload.get('completed') or 'error' in payload:
+                return
+
+    return Response(events(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 
 @app.route('/download_report/<int:analysis_id>')
@@ -567,12 +2301,161 @@ def download_report(analysis_id):
     if analysis.status != 'completed':
         flash("Отчет еще не готов", "warning")
         return redirect(url_for('dashboard'))
-    report_path = os.path.join('reports', analysis.report_filename)
-    if not os.path.exists(report_path):
-        flash("Файл отчета не найден", "danger")
+    report_format = request.args.get('format', 'md')
+    if report_format not in REPORT_FORMATS:
+        flash("Неизвестный формат отчета", "danger")
+        return redirect(url_for('dashboard'))
+    try:
+        digest, report_path = cached_report(analysis, report_format)
+    except ImportError:
+        flash("Формат отчета недоступен", "danger")
         return redirect(url_for('dashboard'))
-    return send_file(report_path, as_attachment=True, mimetype='text/markdown',
-                     download_name=f"team_analysis_{analysis_id}.md")
+    etag, encoding = digest, None
+    for candidate in ('br', 'gzip'):
+        candidate_path = f"{report_path}.{'gz' if candidate == 'gzip' else candidate}"
+        if request.accept_encodings[candidate] and os.path.exists(candidate_path):
+            report_path, etag, encoding = candidate_path, f"{digest}-{candidate}", candidate
+            break
+    response = send_file(report_path, as_attachment=True, mimetype=REPORT_FORMATS[report_format],
+                         download_name=f"team_analysis_{analysis_id}.{report_format}", etag=etag,
+                         conditional=True, max_age=0)
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    return response
+
+
+@app.route('/api/export/<dataset>')
+@login_required
+def export_data(dataset):
+    if current_user.role != 'company':
+        return jsonify({'error': 'Доступ запрещен'}), 403
+    if dataset not in EXPORT_DATASETS:
+        return jsonify({'error': 'Неизвестный набор данных'}), 404
+    export_format = request.args.get('format', 'csv')
+    if export_format not in EXPORT_FORMATS:
+        return jsonify({'error': 'Неизвестный формат выгрузки'}), 400
+    test_id = request.args.get('test_id', type=int)
+    if test_id is not None and not Test.query.filter_by(id=test_id, company_id=current_user.id).first():
+        return jsonify({'error': 'Тест не найден'}), 404
+    try:
+        chunks = export_stream(dataset, export_format, current_user.id, test_id)
+    except ImportError:
+        return jsonify({'error': 'Формат выгрузки недоступен'}), 400
+    filename = f"{dataset}_{test_id or 'all'}.{export_format}"
+    return Response(chunks, mimetype=EXPORT_FORMATS[export_format],
+                    headers={'Content-Disposition': f'attachment; filename="{filename}"', 'X-Accel-Buffering': 'no'})
+
+
+def export_answers_query(company_id, test_id=None):
+    query = db.session.query(
+        Answer.test_id, Answer.user_id, User.name.label('user_name'), Answer.question_id, Question.question_type,
+        Question.category, Answer.value, Answer.created_at
+    ).join(Test, Test.id == Answer.test_id).join(User, User.id == Answer.user_id).join(
+        Question, Question.id == Answer.question_id
+    ).filter(Test.company_id == company_id)
+    if test_id is not None:
+        query = query.filter(Answer.test_id == test_id)
+    return query
+
+
+def export_scores_query(company_id, test_id=None):
+    query = db.session.query(
+        EmployeeScore.test_id, EmployeeScore.user_id, User.name.label('user_name'), EmployeeScore.question_type,
+        EmployeeScore.category, EmployeeScore.total, EmployeeScore.answer_count
+    ).join(Test, Test.id == EmployeeScore.test_id).join(User, User.id == EmployeeScore.user_id).filter(
+        Test.company_id == company_id
+    )
+    if test_id is not None:
+        query = query.filter(EmployeeScore.test_id == test_id)
+    return query
+
+
+EXPORT_DATASETS = {
+    'answers': (export_answers_query, [('test_id', 'int64'), ('user_id', 'int64'), ('user_name', 'string'),
+                                       ('question_id', 'int64'), ('question_type', 'string'), ('category', 'string'),
+                                       ('value', 'int64'), ('created_at', 'timestamp[us]')]),
+    'scores': (export_scores_query, [('test_id', 'int64'), ('user_id', 'int64'), ('user_name', 'string'),
+                                     ('question_type', 'string'), ('category', 'string'), ('total', 'int64'),
+                                     ('answer_count', 'int64')]),
+}
+EXPORT_FORMATS = {
+    'csv': 'text/csv',
+    'parquet': 'application/vnd.apache.parquet',
+    'arrow': 'application/vnd.apache.arrow.stream',
+}
+
+
+class ExportSink:
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def export_stream(dataset, export_format, company_id, test_id=None):
+    query_builder, columns = EXPORT_DATASETS[dataset]
+    batches = export_batches(db.engine, query_builder(company_id, test_id).statement)
+    if export_format == 'csv':
+        return export_csv(columns, batches)
+    import pyarrow as pa
+    schema = pa.schema([(name, pa.type_for_alias(type_name)) for name, type_name in columns])
+    sink = ExportSink()
+    if export_format == 'parquet':
+        import pyarrow.parquet as pq
+        writer = pq.ParquetWriter(sink, schema, compression='zstd')
+    else:
+        writer = pa.ipc.new_stream(sink, schema)
+    return export_record_batches(schema, writer, sink, batches)
+
+
+def export_batches(engine, statement):
+    with engine.connect() as connection:
+        result = connection.execution_options(yield_per=app.config['EXPORT_BATCH_SIZE']).execute(statement)
+        yield from result.partitions()
+
+
+def export_csv(columns, batches):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow([name for name, type_name in columns])
+    yield buffer.getvalue().encode('utf-8')
+    for rows in batches:
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows(rows)
+        yield buffer.getvalue().encode('utf-8')
+
+
+def export_record_batches(schema, writer, sink, batches):
+    import pyarrow as pa
+    try:
+        for rows in batches:
+            arrays = [pa.array(values, type=field.type) for values, field in zip(zip(*rows), schema)]
+            writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+            yield sink.drain()
+    finally:
+        writer.close()
+    yield sink.drain()
 
 
 @app.route('/take_test')
@@ -590,16 +2473,288 @@ def take_test():
     return redirect(current_user.test_link)
 
 
+@app.route('/metrics')
+def metrics_endpoint():
+    if not app.config['METRICS_ENABLED']:
+        return jsonify({'error': 'Метрики отключены'}), 404
+    token = app.config['METRICS_TOKEN']
+    if token and not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        return jsonify({'error': 'Доступ запрещен'}), 403
+    cache_counters = [(('analysis_cache_events_total', (('event', name),)), value)
+                      for name, value in analysis_cache_stats.items()]
+    startup_gauges = [(('startup_duration_seconds', (('phase', phase),)), round(seconds, 6))
+                      for phase, seconds in startup_timings.items()]
+    return Response(metrics.render(cache_counters + startup_gauges), mimetype='text/plain; version=0.0.4')
+
+
+HOT_QUERIES = {
+    'company_dashboard.active_tests': lambda: active_tests_query(1),
+    'company_dashboard.available_reports': lambda: keyset_query(
+        available_reports_query(1), AnalysisResult.completed_at, AnalysisResult.id, True, None, 5),
+    'api_employees': lambda: keyset_query(
+        company_employees_query('company'), User.name, User.id, False, encode_cursor('name', 1), 50),
+    'api_tests': lambda: keyset_query(company_tests_query(1), Test.id, Test.id, True, encode_cursor(1, 1), 50),
+    'api_analysis_results': lambda: keyset_query(
+        analysis_results_query(1, 'completed'), AnalysisResult.completed_at, AnalysisResult.id, True,
+        encode_cursor(datetime.utcnow(), 1), 50),
+    'api_analysis_results.created': lambda: keyset_query(
+        analysis_results_query(1), AnalysisResult.id, AnalysisResult.id, True, encode_cursor(1, 1), 50),
+    'employee_dashboard.last_test': lambda: last_finished_test_query(1).limit(1),
+    'employee_results': lambda: employee_results_query(1).limit(5),
+    'team_trends': lambda: team_trends_query([1, 2], 'company'),
+    'employee_trends': lambda: employee_trends_query([1, 2], 'company', 1),
+    'view_employees': lambda: company_employees_query('company'),
+    'prepare_test_data.scores': lambda: employee_score_rows_query(1, 'company'),
+    'analysis_queue.claim': lambda: claimable_analysis_jobs_query(datetime.utcnow()).limit(1),
+    'scheduler.expired_tests': lambda: expired_tests_query(datetime.utcnow()),
+    'export.answers': lambda: export_answers_query(1),
+    'export.answers_test': lambda: export_answers_query(1, 1),
+    'export.scores': lambda: export_scores_query(1),
+}
+
+
+def audit_query_plans():
+    full_scans = []
+    connection = db.session.connection()
+    prefix = 'EXPLAIN QUERY PLAN ' if db.engine.dialect.name == 'sqlite' else 'EXPLAIN '
+    for name, build_query in HOT_QUERIES.items():
+        compiled = build_query().statement.compile(dialect=db.engine.dialect,
+                                                    compile_kwargs={'render_postcompile': True})
+        params = [compiled.params[key] for key in compiled.positiontup] if compiled.positional else compiled.params
+        plan = [' '.join(str(column) for column in row)
+                for row in connection.exec_driver_sql(prefix + str(compiled), tuple(params)
+                                                      if compiled.positional else params)]
+        scans = [line for line in plan if is_full_scan(line)]
+        print(f"{name}{' — FULL SCAN' if scans else ''}")
+        for line in plan:
+            print(f"    {line}")
+        if scans:
+            full_scans.append(name)
+    return full_scans
+
+
+def is_full_scan(plan_line):
+    if 'Seq Scan' in plan_line:
+        return True
+    detail = plan_line.split(' ', 3)[-1]
+    return detail.startswith('SCAN ') and ' USING ' not in detail and detail.split()[1] in db.metadata.tables
+
+
+@app.cli.command('explain-queries')
+def explain_queries_command():
+    full_scans = audit_query_plans()
+    if full_scans:
+        print(f"Полное сканирование таблиц: {', '.join(full_scans)}")
+        raise SystemExit(1)
+
+
+@app.cli.command('import-employees')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--company', required=True, help='Название компании')
+@click.option('--test-link', help='Ссылка на тест для всех сотрудников')
+@click.option('--test-expires', help='Дата окончания теста (ГГГГ-ММ-ДД)')
+def import_employees_command(path, company, test_link, test_expires):
+    if not User.query.filter_by(role='company', name=company).first():
+        raise click.ClickException(f"Компания {company} не найдена")
+    try:
+        with open(path, 'rb') as f:
+            records = parse_employee_records(path, f.read())
+        test_expires = parse_test_expires(test_expires)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    report = import_employees(records, company, test_link, test_expires)
+    for error in report['errors']:
+        click.echo(f"Строка {error['row']} ({error['email']}): {error['error']}", err=True)
+    click.echo(f"Добавлено сотрудников: {report['created']}, ошибок: {report['failed']}")
+
+
+@app.cli.command('close-expired-tests')
+def close_expired_tests_command():
+    closed = close_expired_tests()
+    click.echo(f"Закрыто тестов: {closed}")
+
+
+@app.cli.command('export-data')
+@click.argument('dataset', type=click.Choice(list(EXPORT_DATASETS)))
+@click.option('--company', required=True, help='Название компании')
+@click.option('--test-id', type=int, help='Выгрузить только один тест')
+@click.option('--format', 'export_format', type=click.Choice(list(EXPORT_FORMATS)), default='csv')
+@click.option('--output', type=click.File('wb'), default='-', help='Файл для выгрузки (по умолчанию stdout)')
+def export_data_command(dataset, company, test_id, export_format, output):
+    company_user = User.query.filter_by(role='company', name=company).first()
+    if not company_user:
+        raise click.ClickException(f"Компания {company} не найдена")
+    if test_id is not None and not Test.query.filter_by(id=test_id, company_id=company_user.id).first():
+        raise click.ClickException(f"Тест {test_id} не найден")
+    for chunk in export_stream(dataset, export_format, company_user.id, test_id):
+        output.write(chunk)
+
+
+@app.cli.command('migrate-db')
+def migrate_db_command():
+    applied = migrate_db()
+    click.echo(f"Применено миграций: {applied}, версия схемы: {schema_version()}")
+
+
+def create_schema():
+    db.create_all()
+
+
+def add_column(table, name, column_type, nullable=True, default=None, references=None):
+    connection = db.session.connection()
+    if name in {column['name'] for column in inspect(connection).get_columns(table)}:
+        return
+    if not nullable and default is None:
+        raise RuntimeError(f"Нельзя добавить NOT NULL колонку {table}.{name} без значения по умолчанию")
+    dialect = connection.dialect
+    ddl = f"{name} {column_type.compile(dialect=dialect)}"
+    if default is not None:
+        ddl += " DEFAULT " + str(db.literal(default, column_type).compile(
+            dialect=dialect, compile_kwargs={'literal_binds': True}))
+    if not nullable:
+        ddl += " NOT NULL"
+    if references and dialect.name == 'sqlite':
+        ddl += f" REFERENCES {references}"
+    connection.exec_driver_sql(f"ALTER TABLE {table} ADD COLUMN {ddl}")
+    if references and dialect.name != 'sqlite':
+        connection.exec_driver_sql(f"ALTER TABLE {table} ADD FOREIGN KEY ({name}) REFERENCES {references}")
+
+
+def index_names(table):
+    connection = db.session.connection()
+    if connection.dialect.name == 'sqlite':
+        return set(connection.exec_driver_sql(
+            "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = ?", (table,)).scalars())
+    return {index['name'] for index in inspect(connection).get_indexes(table)}
+
+
+def create_index(name, table, *columns):
+    if name not in index_names(table):
+        db.session.connection().exec_driver_sql(f"CREATE INDEX {name} ON {table} ({', '.join(columns)})")
+
+
+def drop_index(name, table):
+    if name in index_names(table):
+        connection = db.session.connection()
+        on_table = f" ON {table}" if connection.dialect.name in ('mysql', 'mariadb') else ''
+        connection.exec_driver_sql(f"DROP INDEX {name}{on_table}")
+
+
+def upgrade_unversioned_schema():
+    add_column('tests', 'question_set_id', db.Integer(), references='question_sets (id)')
+    add_column('questions', 'question_set_id', db.Integer(), references='question_sets (id)')
+    add_column('analysis_results', 'payload', db.Text())
+    add_column('analysis_results', 'attempts', db.Integer(), nullable=False, default=0)
+    add_column('analysis_results', 'started_at', db.DateTime())
+    add_column('analysis_results', 'next_attempt_at', db.DateTime())
+    add_column('analysis_results', 'draft_for_id', db.Integer(), references='analysis_results (id)')
+    add_column('analysis_results', 'scheduled', db.Boolean(), nullable=False, default=False)
+    create_index('ix_users_comp_name_role_name', 'users', 'comp_name', 'role', 'name')
+    create_index('ix_tests_company_active_end', 'tests', 'company_id', 'is_active', 'end_date')
+    create_index('ix_tests_active_end', 'tests', 'is_active', 'end_date')
+    create_index('ix_answers_user_test', 'answers', 'user_id', 'test_id')
+    create_index('ix_answers_test_user', 'answers', 'test_id', 'user_id')
+    create_index('ix_test_questions_test_id', 'test_questions', 'test_id')
+    create_index('ix_employee_scores_user_test', 'employee_scores', 'user_id', 'test_id')
+    create_index('ix_analysis_results_user_status_completed', 'analysis_results', 'user_id', 'status', 'completed_at')
+    create_index('ix_analysis_results_status_next_attempt', 'analysis_results', 'status', 'next_attempt_at')
+    create_index('ix_analysis_cache_last_used_at', 'analysis_cache', 'last_used_at')
+
+
+def seed_questions():
+    get_question_set_id()
+
+
+def create_users_email_lower_index():
+    if db.engine.dialect.name in ('sqlite', 'postgresql'):
+        create_index('ix_users_email_lower', 'users', 'lower(email)')
+
+
+def add_analysis_heartbeat_column():
+    add_column('analysis_results', 'heartbeat_at', db.DateTime())
+
+
+def drop_users_comp_name_role_index():
+    drop_index('ix_users_comp_name_role', 'users')
+
+
+def backfill_employee_scores():
+    for test in Test.query.filter(Test.id.in_(db.select(Answer.test_id)),
+                                  Test.id.not_in(db.select(EmployeeScore.test_id))):
+        rebuild_employee_scores(test)
+
+
+MIGRATIONS = [
+    (1, create_schema),
+    (2, upgrade_unversioned_schema),
+    (3, seed_questions),
+    (4, backfill_employee_scores),
+    (5, create_users_email_lower_index),
+    (6, add_analysis_heartbeat_column),
+    (7, drop_users_comp_name_role_index),
+]
+
+
+def schema_version():
+    try:
+        return db.session.query(db.func.max(SchemaMigration.version)).scalar() or 0
+    except (OperationalError, ProgrammingError):
+        db.session.rollback()
+        return 0
+
+
+@contextmanager
+def migration_lock():
+    with open(app.config['MIGRATION_LOCK_FILE'], 'w') as lock_file:
+        if fcntl:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        yield
+
+
+def migrate_db():
+    if schema_version() >= MIGRATIONS[-1][0]:
+        return 0
+    applied = 0
+    with migration_lock():
+        current = schema_version()
+        for version, migration in MIGRATIONS:
+            if version <= current:
+                continue
+            migration()
+            db.session.add(SchemaMigration(version=version, name=migration.__name__))
+            db.session.commit()
+            applied += 1
+    return applied
+
+
+startup_timings = {}
+
+
 def init_db():
+    started = time.perf_counter()
     with app.app_context():
-        db.create_all()
-        if not Question.query.filter_by(question_type='disc').first():
-            create_disc_questions(1)
-        if not Question.query.filter_by(question_type='eq').first():
-            create_eq_questions(1)
-        db.session.commit()
+        if db.engine.dialect.name not in UPSERT_DIALECTS:
+            raise RuntimeError(f"СУБД {db.engine.dialect.name} не поддерживается")
+        applied = migrate_db()
+        if app.config['QUERY_PLAN_AUDIT']:
+            audit_query_plans()
+    startup_timings['migrations'] = time.perf_counter() - started
+    return applied
+
+
+def bootstrap(workers=True):
+    applied = init_db()
+    if workers:
+        started = time.perf_counter()
+        start_analysis_workers()
+        startup_timings['workers'] = time.perf_counter() - started
+    total_ms = sum(startup_timings.values()) * 1000
+    phases = ', '.join(f"{phase} {seconds * 1000:.0f} мс" for phase, seconds in startup_timings.items())
+    log = app.logger.warning if app.config['SLOW_REQUEST_MS'] and total_ms >= app.config['SLOW_REQUEST_MS'] \
+        else app.logger.info
+    log(f"Приложение готово за {total_ms:.0f} мс (миграций применено: {applied}): {phases}")
 
 
 if __name__ == '__main__':
-    init_db()
+    bootstrap(workers=os.environ.get('WERKZEUG_RUN_MAIN') == 'true')
     app.run(debug=True)
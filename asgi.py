@@ -0,0 +1,232 @@
+import asyncio
+import json
+import re
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from flask_login import current_user
+
+from app import (app, db, AnalysisResult, analysis_progress, analysis_progress_condition, analysis_progress_listeners,
+                 analysis_status_payload, bootstrap)
+
+ANALYSIS_ROUTE = re.compile(r'^/api/analysis_(status|stream)/(\d+)$')
+executor = ThreadPoolExecutor(max_workers=app.config['ASGI_THREADS'], thread_name_prefix='asgi')
+broadcast = None
+
+
+class ProgressBroadcast:
+    def __init__(self, loop):
+        self.loop = loop
+        self.events = {}
+
+    def subscribe(self, analysis_id):
+        return self.events.setdefault(analysis_id, asyncio.Event())
+
+    def notify(self, analysis_id):
+        self.loop.call_soon_threadsafe(self.fire, analysis_id)
+
+    def fire(self, analysis_id):
+        event = self.events.pop(analysis_id, None)
+        if event is not None:
+            event.set()
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        await lifespan(receive, send)
+        return
+    if scope['type'] != 'http':
+        return
+    match = ANALYSIS_ROUTE.match(scope['path'])
+    if match and scope['method'] == 'GET':
+        handler = analysis_stream if match.group(1) == 'stream' else analysis_status
+        await handler(scope, receive, send, int(match.group(2)))
+    else:
+        await call_flask(scope, receive, send)
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            try:
+                progress_broadcast()
+                await run_sync(bootstrap)
+            except Exception as e:
+                await send({'type': 'lifespan.startup.failed', 'message': str(e)})
+                return
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+def run_sync(function, *args):
+    return asyncio.get_running_loop().run_in_executor(executor, function, *args)
+
+
+def progress_broadcast():
+    global broadcast
+    if broadcast is None:
+        broadcast = ProgressBroadcast(asyncio.get_running_loop())
+        analysis_progress_listeners.append(broadcast.notify)
+    return broadcast
+
+
+async def call_flask(scope, receive, send):
+    body = BytesIO()
+    while True:
+        message = await receive()
+        body.write(message.get('body', b''))
+        if not message.get('more_body'):
+            break
+    status, headers, result = await run_sync(run_wsgi, build_environ(scope, body.getvalue()))
+    disconnected = asyncio.ensure_future(wait_for_disconnect(receive))
+    chunks = iter(result)
+    try:
+        await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+        while not disconnected.done():
+            chunk = await run_sync(next, chunks, None)
+            if chunk is None:
+                break
+            if chunk:
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        await send({'type': 'http.response.body', 'body': b''})
+    finally:
+        disconnected.cancel()
+        if hasattr(result, 'close'):
+            await run_sync(result.close)
+
+
+def run_wsgi(environ):
+    response = {}
+
+    def start_response(status, headers, exc_info=None):
+        response['status'] = int(status.split(' ', 1)[0])
+        response['headers'] = [(name.lower().encode('latin1'), value.encode('latin1')) for name, value in headers]
+
+    result = app.wsgi_app(environ, start_response)
+    return response['status'], response['headers'], result
+
+
+def build_environ(scope, body):
+    server = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin1'),
+        'QUERY_STRING': scope['query_string'].decode('ascii'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope['http_version']}",
+        'REMOTE_ADDR': scope['client'][0] if scope.get('client') else '',
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope['headers']:
+        name = name.decode('latin1').upper().replace('-', '_')
+        if name not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            name = 'HTTP_' + name
+        value = value.decode('latin1')
+        separator = '; ' if name == 'HTTP_COOKIE' else ','
+        environ[name] = f"{environ[name]}{separator}{value}" if name in environ else value
+    return environ
+
+
+def analysis_access(environ, analysis_id):
+    with app.request_context(environ):
+        if not current_user.is_authenticated:
+            return 401, {"error": "Требуется авторизация"}
+        analysis = db.session.get(AnalysisResult, analysis_id)
+        if analysis is None:
+            return 404, {"error": "Анализ не найден"}
+        if analysis.user_id != current_user.id:
+            return 403, {"error": "Доступ запрещен"}
+        payload, status_code = analysis_status_payload(analysis)
+        return status_code, payload
+
+
+def stored_analysis_status(analysis_id):
+    with app.app_context():
+        payload, status_code = analysis_status_payload(db.session.get(AnalysisResult, analysis_id))
+        return payload
+
+
+async def send_json(send, status, payload):
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(b'content-type', b'application/json'), (b'cache-control', b'no-cache')]})
+    await send({'type': 'http.response.body', 'body': json.dumps(payload, ensure_ascii=False).encode('utf-8')})
+
+
+async def analysis_status(scope, receive, send, analysis_id):
+    status, payload = await run_sync(analysis_access, build_environ(scope, b''), analysis_id)
+    await send_json(send, status, payload)
+
+
+async def analysis_stream(scope, receive, send, analysis_id):
+    status, payload = await run_sync(analysis_access, build_environ(scope, b''), analysis_id)
+    if status not in (200, 500):
+        await send_json(send, status, payload)
+        return
+    await send({'type': 'http.response.start', 'status': 200,
+                'headers': [(b'content-type', b'text/event-stream; charset=utf-8'), (b'cache-control', b'no-cache'),
+                            (b'x-accel-buffering', b'no')]})
+    disconnected = asyncio.ensure_future(wait_for_disconnect(receive))
+    try:
+        async for event in analysis_events(analysis_id, disconnected):
+            await send({'type': 'http.response.body', 'body': event.encode('utf-8'), 'more_body': True})
+        await send({'type': 'http.response.body', 'body': b''})
+    finally:
+        disconnected.cancel()
+
+
+async def wait_for_disconnect(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+
+async def analysis_events(analysis_id, disconnected):
+    version = None
+    sent = 0
+    stored_sent = False
+    while not disconnected.done():
+        changed = progress_broadcast().subscribe(analysis_id)
+        with analysis_progress_condition:
+            state = dict(analysis_progress.get(analysis_id, {}))
+        if state and state['version'] != version:
+            version = state['version']
+            progress = min(95, int(state['tokens'] * 100 / app.config['ANALYSIS_EXPECTED_TOKENS']))
+            yield "data: " + json.dumps({"completed": False, "progress": progress, "tokens": state['tokens'],
+                                         "delta": state['partial'][sent:],
+                                         "message": "Идет анализ данных..."}, ensure_ascii=False) + "\n\n"
+            sent = len(state['partial'])
+            stored_sent = False
+            continue
+        if not state and not stored_sent:
+            version = None
+            sent = 0
+            payload = await run_sync(stored_analysis_status, analysis_id)
+            yield "data: " + json.dumps(payload, ensure_ascii=False) + "\n\n"
+            if payload.get('completed') or 'error' in payload:
+                return
+            stored_sent = True
+            continue
+        waiter = asyncio.ensure_future(changed.wait())
+        done, _ = await asyncio.wait({waiter, disconnected}, timeout=app.config['ANALYSIS_STREAM_KEEPALIVE'],
+                                           return_when=asyncio.FIRST_COMPLETED)
+        waiter.cancel()
+        if waiter in done or not state:
+            stored_sent = False
+        elif not done:
+            yield ": keep-alive\n\n"
+
+
+if __name__ == '__main__':
+    import uvicorn
+    uvicorn.run('asgi:application', host=app.config['ASGI_HOST'], port=app.config['ASGI_PORT'])
@@ -0,0 +1,276 @@
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+from unittest import mock
+
+BENCH_DIR = tempfile.mkdtemp(prefix='work-team-bench-')
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(BENCH_DIR, 'bench.db')}"
+os.environ['REPORT_CACHE_DIR'] = os.path.join(BENCH_DIR, 'report_cache')
+os.environ['MIGRATION_LOCK_FILE'] = os.path.join(BENCH_DIR, 'migrate.lock')
+os.environ['ANALYSIS_WORKERS'] = '0'
+os.environ.pop('IDENTITY_CACHE_DIR', None)
+
+import numpy as np
+from flask_login import FlaskLoginClient, login_user
+from sqlalchemy import event
+from werkzeug.security import generate_password_hash
+
+import app as work_team
+from app import app, db, User, Test, Question, Answer, AnalysisResult
+
+DEFAULT_SIZES = (10, 100, 1000, 10000)
+
+
+def fake_generate(model, system, prompt, format=None, options=None, keep_alive=None, stream=False):
+    payload = json.loads(prompt)
+    result = {
+        'disc_analysis': {disc_type: {'description': f"Описание типа {disc_type.upper()}"}
+                          for disc_type in work_team.DISC_TYPES},
+        'eq_analysis': {'strong_areas': ['Эмпатия'], 'weak_areas': ['Самомотивация']},
+        'compatibility': {'score': 7, 'conflict_warnings': ['Разный темп работы'],
+                          'synergy_pairs': [pair['pair'] for pair in
+                                            payload.get('aggregates', {}).get('synergy_candidates', [])]},
+        'recommendations': {
+            'individual': [{'name': employee['name'], 'advice': 'Развивать навыки коммуникации'}
+                           for employee in payload.get('employees', [])],
+            'team': ['Проводить регулярные встречи']
+        }
+    }
+    response = json.dumps(result, ensure_ascii=False)
+    if not stream:
+        return {'response': response, 'eval_count': len(response) // 4}
+    return ({'response': response[i:i + 64], 'eval_count': i // 64 + 1} for i in range(0, len(response), 64))
+
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.started = []
+
+    def before(self, conn, cursor, statement, parameters, context, executemany):
+        self.started.append(time.perf_counter())
+
+    def after(self, conn, cursor, statement, parameters, context, executemany):
+        self.count += 1
+        self.seconds += time.perf_counter() - self.started.pop()
+
+    def reset(self):
+        self.count = 0
+        self.seconds = 0.0
+
+
+def seed_tenant(size, password_hash, rng):
+    company = User(role='company', name=f"bench-company-{size}", email=f"company-{size}@bench.local",
+                   password=password_hash)
+    db.session.add(company)
+    db.session.flush()
+    db.session.execute(db.insert(User), [
+        {'role': 'employee', 'name': f"Сотрудник {size}-{i:05d}", 'comp_name': company.name,
+         'email': f"employee-{size}-{i}@bench.local", 'password': password_hash}
+        for i in range(size)])
+    test = Test(company_id=company.id, end_date=datetime.utcnow() + timedelta(days=7), is_active=True,
+                question_set_id=work_team.get_question_set_id())
+    db.session.add(test)
+    db.session.flush()
+    question_ids = [question_id for question_id, in db.session.query(Question.id).filter_by(
+        question_set_id=test.question_set_id)]
+    employee_ids = [user_id for user_id, in db.session.query(User.id).filter_by(comp_name=company.name)]
+    for start in range(0, len(employee_ids), 500):
+        db.session.execute(db.insert(Answer), [
+            {'user_id': user_id, 'question_id': question_id, 'test_id': test.id, 'value': rng.randint(1, 5)}
+            for user_id in employee_ids[start:start + 500] for question_id in question_ids])
+    work_team.rebuild_employee_scores(test)
+    analysis = AnalysisResult(test_id=test.id, user_id=company.id, status='processing',
+                              model=work_team.DEEPSEEK_MODEL)
+    db.session.add(analysis)
+    db.session.flush()
+    db.session.commit()
+    return {'company_id': company.id, 'company_name': company.name, 'employee_id': employee_ids[0],
+            'test_id': test.id, 'analysis_id': analysis.id}
+
+
+def detached_user(user_id):
+    with app.app_context():
+        user = db.session.get(User, user_id)
+        user.id
+        db.session.expunge_all()
+    return user
+
+
+def in_company_request(tenant, work):
+    def run():
+        with app.test_request_context():
+            login_user(db.session.get(User, tenant['company_id']))
+            work()
+    return run
+
+
+def tenant_operations(tenant):
+    company_client = app.test_client(user=detached_user(tenant['company_id']))
+    employee_client = app.test_client(user=detached_user(tenant['employee_id']))
+    with app.test_request_context():
+        login_user(db.session.get(User, tenant['company_id']))
+        test_data = work_team.prepare_test_data(tenant['test_id'])
+        analysis = db.session.get(AnalysisResult, tenant['analysis_id'])
+        work_team.complete_analysis(analysis, work_team.analyze_with_deepseek(test_data))
+        db.session.commit()
+
+    def clear_roster():
+        work_team.identity_cache.delete(('roster', tenant['company_name']))
+
+    def render(report_format):
+        def run():
+            with app.test_request_context():
+                work_team.render_report(db.session.get(AnalysisResult, tenant['analysis_id']), report_format)
+        return run
+
+    def request(client, method, path, **kwargs):
+        def run():
+            response = client.open(path, method=method, **kwargs)
+            if response.status_code >= 400:
+                raise RuntimeError(f"{method} {path}: {response.status_code}")
+        return run
+
+    end_date = (datetime.now() + timedelta(days=7)).strftime('%Y-%m-%d')
+    return {
+        'prepare_test_data': (clear_roster, in_company_request(
+            tenant, lambda: work_team.prepare_test_data(tenant['test_id']))),
+        'analyze_with_deepseek': (None, lambda: work_team.analyze_with_deepseek(test_data)),
+        'render_report.md': (None, render('md')),
+        'render_report.html': (None, render('html')),
+        'GET /company/dashboard': (clear_roster, request(company_client, 'GET', '/company/dashboard')),
+        'GET /api/employees': (None, request(company_client, 'GET', '/api/employees')),
+        'GET /api/analysis_results': (None, request(company_client, 'GET', '/api/analysis_results')),
+        'POST /create_test': (None, request(company_client, 'POST', '/create_test', data={'end_date': end_date})),
+        'POST /start_deepseek_analysis': (clear_roster, request(
+            company_client, 'POST', '/start_deepseek_analysis', json={'test_id': tenant['test_id']})),
+        'GET /download_report': (None, request(
+            company_client, 'GET', f"/download_report/{tenant['analysis_id']}?format=html")),
+        'GET /employee/dashboard': (None, request(employee_client, 'GET', '/employee/dashboard')),
+        'GET /api/employee/results': (None, request(employee_client, 'GET', '/api/employee/results')),
+    }
+
+
+def measure(setup, work, repeat, counter):
+    timings, queries, query_seconds = [], [], []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        counter.reset()
+        started = time.perf_counter()
+        work()
+        timings.append(time.perf_counter() - started)
+        queries.append(counter.count)
+        query_seconds.append(counter.seconds)
+    if setup:
+        setup()
+    tracemalloc.start()
+    work()
+    peak_memory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    timings_ms = np.array(timings) * 1000
+    return {
+        'p50_ms': round(float(np.percentile(timings_ms, 50)), 3),
+        'p95_ms': round(float(np.percentile(timings_ms, 95)), 3),
+        'mean_ms': round(float(timings_ms.mean()), 3),
+        'queries': int(np.median(queries)),
+        'query_ms': round(float(np.median(query_seconds)) * 1000, 3),
+        'peak_memory_kb': round(peak_memory / 1024, 1),
+    }
+
+
+def run_benchmark(sizes, repeat, operations=None):
+    rng = random.Random(42)
+    password_hash = generate_password_hash('benchmark-password')
+    app.config.update(TESTING=True, WTF_CSRF_ENABLED=False)
+    app.test_client_class = FlaskLoginClient
+    counter = QueryCounter()
+    results = []
+    work_team.init_db()
+    with app.app_context():
+        database = db.engine.dialect.name
+        event.listen(db.engine, 'before_cursor_execute', counter.before)
+        event.listen(db.engine, 'after_cursor_execute', counter.after)
+        tenants = []
+        for size in sizes:
+            started = time.perf_counter()
+            tenants.append((size, seed_tenant(size, password_hash, rng)))
+            print(f"Сгенерирована компания на {size} сотрудников за {time.perf_counter() - started:.1f} с",
+                  file=sys.stderr)
+    with mock.patch.object(work_team.ollama_client, 'generate', side_effect=fake_generate):
+        for size, tenant in tenants:
+            with app.app_context():
+                tenant_ops = tenant_operations(tenant)
+            for name, (setup, work) in tenant_ops.items():
+                if operations and name not in operations:
+                    continue
+                stats = measure(setup, work, repeat, counter)
+                results.append(dict(operation=name, employees=size, **stats))
+                print(f"{name} [{size}]: p50 {stats['p50_ms']} мс, p95 {stats['p95_ms']} мс, "
+                      f"запросов {stats['queries']}", file=sys.stderr)
+    return {
+        'generated_at': datetime.utcnow().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'database': database,
+        'repeat': repeat,
+        'results': results,
+    }
+
+
+def find_regressions(report, baseline, tolerance):
+    previous = {(entry['operation'], entry['employees']): entry for entry in baseline['results']}
+    regressions = []
+    for entry in report['results']:
+        before = previous.get((entry['operation'], entry['employees']))
+        if not before:
+            continue
+        if entry['p95_ms'] > before['p95_ms'] * (1 + tolerance):
+            regressions.append(f"{entry['operation']} [{entry['employees']}]: p95 {before['p95_ms']} → "
+                               f"{entry['p95_ms']} мс")
+        if entry['queries'] > before['queries']:
+            regressions.append(f"{entry['operation']} [{entry['employees']}]: запросов {before['queries']} → "
+                               f"{entry['queries']}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Нагрузочный бенчмарк на синтетических компаниях')
+    parser.add_argument('--sizes', default=','.join(map(str, DEFAULT_SIZES)),
+                        help='размеры компаний через запятую')
+    parser.add_argument('--repeat', type=int, default=20, help='число замеров на операцию')
+    parser.add_argument('--operation', action='append', help='замерять только указанные операции')
+    parser.add_argument('--output', help='файл для JSON-результатов (по умолчанию stdout)')
+    parser.add_argument('--baseline', help='JSON предыдущего прогона для сравнения')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='допустимый рост p95 относительно baseline')
+    args = parser.parse_args()
+    try:
+        report = run_benchmark([int(size) for size in args.sizes.split(',')], args.repeat, args.operation)
+    finally:
+        shutil.rmtree(BENCH_DIR, ignore_errors=True)
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output)
+    else:
+        print(output)
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            regressions = find_regressions(report, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"Регрессия: {regression}", file=sys.stderr)
+        if regressions:
+            raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
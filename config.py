@@ -1,3 +1,4 @@
+import json
 import os
 from pathlib import Path
 
@@ -7,5 +8,81 @@ INSTANCE_PATH = BASE_DIR / 'instance'
 os.makedirs(INSTANCE_PATH, exist_ok=True)
 
 SECRET_KEY = os.urandom(24)
-SQLALCHEMY_DATABASE_URI = f'sqlite:///{INSTANCE_PATH}/database.db'
+SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL', f'sqlite:///{INSTANCE_PATH}/database.db')
 SQLALCHEMY_TRACK_MODIFICATIONS = False
+
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': int(os.environ.get('SQLITE_BUSY_TIMEOUT', 10000)),
+    'mmap_size': int(os.environ.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024)),
+}
+DB_LOCK_RETRIES = int(os.environ.get('DB_LOCK_RETRIES', 5))
+
+if SQLALCHEMY_DATABASE_URI in ('sqlite://', 'sqlite:///:memory:'):
+    SQLALCHEMY_ENGINE_OPTIONS = {}
+elif SQLALCHEMY_DATABASE_URI.startswith('sqlite'):
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        'pool_size': int(os.environ.get('DB_POOL_SIZE', 10)),
+        'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 10)),
+        'pool_timeout': 30,
+        'connect_args': {'timeout': SQLITE_PRAGMAS['busy_timeout'] / 1000, 'check_same_thread': False},
+    }
+else:
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        'pool_size': int(os.environ.get('DB_POOL_SIZE', 10)),
+        'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 20)),
+        'pool_timeout': 30,
+        'pool_recycle': 1800,
+        'pool_pre_ping': True,
+    }
+
+ANALYSIS_WORKERS = int(os.environ.get('ANALYSIS_WORKERS', 2))
+ANALYSIS_MAX_ATTEMPTS = int(os.environ.get('ANALYSIS_MAX_ATTEMPTS', 3))
+ANALYSIS_RETRY_DELAY = int(os.environ.get('ANALYSIS_RETRY_DELAY', 30))
+ANALYSIS_JOB_TIMEOUT = int(os.environ.get('ANALYSIS_JOB_TIMEOUT', 3600))
+ANALYSIS_HEARTBEAT_INTERVAL = int(os.environ.get('ANALYSIS_HEARTBEAT_INTERVAL', 15))
+ANALYSIS_LEASE_TIMEOUT = int(os.environ.get('ANALYSIS_LEASE_TIMEOUT', 90))
+ANALYSIS_POLL_INTERVAL = int(os.environ.get('ANALYSIS_POLL_INTERVAL', 5))
+ANALYSIS_CACHE_TTL = int(os.environ.get('ANALYSIS_CACHE_TTL', 30 * 24 * 3600))
+ANALYSIS_CACHE_MAX_ENTRIES = int(os.environ.get('ANALYSIS_CACHE_MAX_ENTRIES', 1000))
+ANALYSIS_EXPECTED_TOKENS = int(os.environ.get('ANALYSIS_EXPECTED_TOKENS', 1500))
+ANALYSIS_STREAM_KEEPALIVE = int(os.environ.get('ANALYSIS_STREAM_KEEPALIVE', 15))
+ANALYSIS_CHUNK_TOKENS = int(os.environ.get('ANALYSIS_CHUNK_TOKENS', 2048))
+ANALYSIS_CHARS_PER_TOKEN = int(os.environ.get('ANALYSIS_CHARS_PER_TOKEN', 3))
+ANALYSIS_MAP_CONCURRENCY = int(os.environ.get('ANALYSIS_MAP_CONCURRENCY', 2))
+ANALYSIS_SYNERGY_CANDIDATES = int(os.environ.get('ANALYSIS_SYNERGY_CANDIDATES', 5))
+ANALYSIS_SYNERGY_BLOCK_ROWS = int(os.environ.get('ANALYSIS_SYNERGY_BLOCK_ROWS', 256))
+QUERY_PLAN_AUDIT = os.environ.get('QUERY_PLAN_AUDIT', '0') == '1'
+IDENTITY_CACHE_TTL = int(os.environ.get('IDENTITY_CACHE_TTL', 30))
+IDENTITY_CACHE_DIR = os.environ.get('IDENTITY_CACHE_DIR')
+REPORT_CACHE_DIR = os.environ.get('REPORT_CACHE_DIR', str(INSTANCE_PATH / 'report_cache'))
+REPORT_CACHE_MAX_BYTES = int(os.environ.get('REPORT_CACHE_MAX_BYTES', 100 * 1024 * 1024))
+PAGE_MAX_LIMIT = int(os.environ.get('PAGE_MAX_LIMIT', 200))
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '0') == '1'
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+SLOW_REQUEST_MS = int(os.environ.get('SLOW_REQUEST_MS', 1000))
+N_PLUS_ONE_THRESHOLD = int(os.environ.get('N_PLUS_ONE_THRESHOLD', 10))
+OLLAMA_HOST = os.environ.get('OLLAMA_HOST')
+OLLAMA_KEEP_ALIVE = os.environ.get('OLLAMA_KEEP_ALIVE', '30m')
+OLLAMA_TIMEOUT = int(os.environ.get('OLLAMA_TIMEOUT', 600))
+OLLAMA_WARMUP = os.environ.get('OLLAMA_WARMUP', '1') == '1'
+OLLAMA_BREAKER_THRESHOLD = int(os.environ.get('OLLAMA_BREAKER_THRESHOLD', 5))
+OLLAMA_BREAKER_RESET = int(os.environ.get('OLLAMA_BREAKER_RESET', 60))
+ANALYSIS_MODEL = os.environ.get('ANALYSIS_MODEL', 'deepseek-r1:7b')
+ANALYSIS_MODEL_ROUTES = json.loads(os.environ.get('ANALYSIS_MODEL_ROUTES', '[]'))
+ANALYSIS_DRAFT_MODEL = os.environ.get('ANALYSIS_DRAFT_MODEL')
+ANALYTICS_MAX_TESTS = int(os.environ.get('ANALYTICS_MAX_TESTS', 50))
+ASGI_HOST = os.environ.get('ASGI_HOST', '127.0.0.1')
+ASGI_PORT = int(os.environ.get('ASGI_PORT', 8000))
+ASGI_THREADS = int(os.environ.get('ASGI_THREADS', 32))
+IMPORT_MAX_ROWS = int(os.environ.get('IMPORT_MAX_ROWS', 10000))
+IMPORT_BATCH_SIZE = int(os.environ.get('IMPORT_BATCH_SIZE', 500))
+IMPORT_HASH_WORKERS = int(os.environ.get('IMPORT_HASH_WORKERS', 0))
+IMPORT_PARALLEL_THRESHOLD = int(os.environ.get('IMPORT_PARALLEL_THRESHOLD', 8))
+SCHEDULER_ENABLED = os.environ.get('SCHEDULER_ENABLED', '1') == '1'
+SCHEDULER_INTERVAL = int(os.environ.get('SCHEDULER_INTERVAL', 60))
+OFF_PEAK_WINDOWS = os.environ.get('OFF_PEAK_WINDOWS', '22:00-06:00')
+SCHEDULED_ANALYSIS_CONCURRENCY = int(os.environ.get('SCHEDULED_ANALYSIS_CONCURRENCY', 1))
+EXPORT_BATCH_SIZE = int(os.environ.get('EXPORT_BATCH_SIZE', 5000))
+MIGRATION_LOCK_FILE = os.environ.get('MIGRATION_LOCK_FILE', str(INSTANCE_PATH / 'migrate.lock'))
@@ -0,0 +1,90 @@
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+BASELINE_SCHEMA = """
+CREATE TABLE users (id INTEGER NOT NULL PRIMARY KEY, role VARCHAR(20) NOT NULL, name VARCHAR(100) NOT NULL,
+    comp_name VARCHAR(100), email VARCHAR(100) NOT NULL UNIQUE, password VARCHAR(100) NOT NULL,
+    test_link VARCHAR(500), test_expires DATETIME);
+CREATE TABLE tests (id INTEGER NOT NULL PRIMARY KEY, company_id INTEGER NOT NULL REFERENCES users (id),
+    created_at DATETIME DEFAULT (CURRENT_TIMESTAMP), end_date DATETIME NOT NULL, is_active BOOLEAN);
+CREATE TABLE questions (id INTEGER NOT NULL PRIMARY KEY, text VARCHAR(500) NOT NULL,
+    question_type VARCHAR(20) NOT NULL, category VARCHAR(50));
+CREATE TABLE answers (id INTEGER NOT NULL PRIMARY KEY, user_id INTEGER NOT NULL REFERENCES users (id),
+    question_id INTEGER NOT NULL REFERENCES questions (id), test_id INTEGER NOT NULL REFERENCES tests (id),
+    value INTEGER NOT NULL, created_at DATETIME DEFAULT (CURRENT_TIMESTAMP));
+CREATE TABLE test_questions (id INTEGER NOT NULL PRIMARY KEY, test_id INTEGER NOT NULL REFERENCES tests (id),
+    question_id INTEGER NOT NULL REFERENCES questions (id));
+CREATE TABLE analysis_results (id INTEGER NOT NULL PRIMARY KEY, test_id INTEGER NOT NULL REFERENCES tests (id),
+    user_id INTEGER NOT NULL REFERENCES users (id), created_at DATETIME DEFAULT (CURRENT_TIMESTAMP),
+    completed_at DATETIME, status VARCHAR(20), model VARCHAR(50) NOT NULL, result_data TEXT,
+    report_filename VARCHAR(100), error TEXT);
+INSERT INTO users (role, name, comp_name, email, password) VALUES ('company', 'Acme', NULL, 'Boss@Acme.io', 'x');
+INSERT INTO users (role, name, comp_name, email, password) VALUES ('employee', 'Emp', 'Acme', 'emp@acme.io', 'x');
+INSERT INTO tests (company_id, end_date, is_active) VALUES (1, '2026-01-01 00:00:00', 1);
+INSERT INTO questions (text, question_type, category) VALUES ('q', 'disc', 'D');
+INSERT INTO test_questions (test_id, question_id) VALUES (1, 1);
+INSERT INTO answers (user_id, question_id, test_id, value) VALUES (2, 1, 1, 4);
+INSERT INTO analysis_results (test_id, user_id, status, model) VALUES (1, 1, 'completed', 'deepseek-r1:7b');
+"""
+
+BOOT = """
+import json
+from app import app, db, init_db, schema_version, EmployeeScore, AnalysisResult
+applied = init_db()
+with app.app_context():
+    print(json.dumps({'applied': applied, 'again': init_db(), 'version': schema_version(),
+                      'scores': EmployeeScore.query.count(),
+                      'attempts': [row.attempts for row in AnalysisResult.query]}))
+"""
+
+
+def boot(tmp_path, database):
+    env = dict(os.environ, DATABASE_URL=f'sqlite:///{database}', ANALYSIS_WORKERS='0',
+               MIGRATION_LOCK_FILE=str(tmp_path / 'migrate.lock'), REPORT_CACHE_DIR=str(tmp_path / 'reports'))
+    output = subprocess.run([sys.executable, '-c', BOOT], cwd=ROOT, env=env, capture_output=True, text=True,
+                            check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def schema(database):
+    connection = sqlite3.connect(database)
+    tables = [name for name, in connection.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table' AND name != 'sqlite_sequence' ORDER BY name")]
+    columns = {table: sorted((row[1], row[3]) for row in connection.execute(f'PRAGMA table_info({table})'))
+               for table in tables}
+    foreign_keys = {table: sorted((row[3], row[2]) for row in connection.execute(f'PRAGMA foreign_key_list({table})'))
+                    for table in tables}
+    indexes = sorted(name for name, in connection.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'index' AND name LIKE 'ix_%'"))
+    connection.close()
+    return columns, foreign_keys, indexes
+
+
+def test_fresh_database_boots(tmp_path):
+    result = boot(tmp_path, tmp_path / 'fresh.db')
+    assert result['applied'] == result['version']
+    assert result['again'] == 0
+    assert 'ix_users_email_lower' in schema(tmp_path / 'fresh.db')[2]
+
+
+def test_baseline_database_upgrades(tmp_path):
+    connection = sqlite3.connect(tmp_path / 'baseline.db')
+    connection.executescript(BASELINE_SCHEMA)
+    connection.close()
+    result = boot(tmp_path, tmp_path / 'baseline.db')
+    assert result['applied'] == result['version']
+    assert result['again'] == 0
+    assert result['scores'] == 1
+    assert result['attempts'] == [0]
+    boot(tmp_path, tmp_path / 'fresh.db')
+    upgraded_columns, upgraded_foreign_keys, upgraded_indexes = schema(tmp_path / 'baseline.db')
+    fresh_columns, fresh_foreign_keys, fresh_indexes = schema(tmp_path / 'fresh.db')
+    assert upgraded_columns == fresh_columns
+    assert upgraded_foreign_keys == fresh_foreign_keys
+    assert upgraded_indexes == fresh_indexes
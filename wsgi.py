@@ -0,0 +1,9 @@
+import time
+
+started = time.perf_counter()
+
+from app import app, bootstrap, startup_timings
+
+startup_timings['import'] = time.perf_counter() - started
+bootstrap()
+application = app